@@ -0,0 +1,41 @@
+# remove the part rows of the jobs the retention policy does not keep (RETENTION_JOBS, RETENTION_DAYS, RETENTION_POLICY)
+# usage: python compact_jobs.py [--dry-run] [spider ...]
+import sys
+from sqlalchemy.orm import sessionmaker
+from scrapy.utils.project import get_project_settings
+from sparepart.models import db_connect, ScrapingJob
+from sparepart.retention import SPIDER_TABLES, retention_policy, expired_jobs, delete_job_rows, job_row_count
+
+dry_run = '--dry-run' in sys.argv
+spiders = [arg for arg in sys.argv[1:] if not arg.startswith('--')] or list(SPIDER_TABLES)
+settings = get_project_settings()
+engine = db_connect()
+session = sessionmaker(bind=engine)()
+
+try:
+    for spider in spiders:
+        policy = retention_policy(settings, spider)
+        jobs = expired_jobs(session, spider, policy)
+        print('{}: policy {}, {} jobs to compact'.format(spider, policy, len(jobs)))
+        if dry_run:
+            for job_id in jobs:
+                print('  {}'.format(job_id))
+            continue
+        # merge mode tables keep the live row of each row_key, whatever job wrote it last
+        keep_live = settings.get('DB_WRITE_MODE', 'insert') == 'merge'
+        for job_id in jobs:
+            left = 0
+            for sparepart_cls in SPIDER_TABLES.get(spider, ()):
+                deleted = delete_job_rows(engine, sparepart_cls, job_id, settings.getint('COMPACTION_BATCH_SIZE', 1000),
+                                          keep_live)
+                kept = job_row_count(engine, sparepart_cls, job_id)
+                left += kept
+                print('  {} {}: {}, {} rows kept'.format(job_id, sparepart_cls.__tablename__,
+                                                         'partition dropped' if deleted is None else
+                                                         '{} rows deleted'.format(deleted), kept))
+            # a job keeping live rows stays finished, and is compacted again by a later run
+            if not left:
+                session.query(ScrapingJob).filter(ScrapingJob.id == job_id).update({'status': 'compacted'})
+                session.commit()
+finally:
+    session.close()
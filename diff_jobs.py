@@ -0,0 +1,29 @@
+# list the part rows added, removed or changed between two jobs of the same spider
+# usage: python diff_jobs.py <part table> <job a> <job b>
+#   e.g. python diff_jobs.py scraping_sparepart_megazip 5f1c... 7a2e...
+import sys
+from sqlalchemy.orm import sessionmaker
+from sparepart.models import db_connect, DeclarativeBase
+from sparepart.history import diff_jobs
+
+if len(sys.argv) != 4:
+    print('usage: python diff_jobs.py <part table> <job a> <job b>')
+    sys.exit(1)
+
+table, job_a, job_b = sys.argv[1:]
+sparepart_cls = next((cls for cls in DeclarativeBase._decl_class_registry.values()
+                      if getattr(cls, '__tablename__', None) == table), None)
+if sparepart_cls is None or not hasattr(sparepart_cls, 'row_key'):
+    print('unknown part table {}'.format(table))
+    sys.exit(1)
+
+session = sessionmaker(bind=db_connect())()
+try:
+    counts = {}
+    for change, row_key, part_number in diff_jobs(session, sparepart_cls, job_a, job_b):
+        counts[change] = counts.get(change, 0) + 1
+        print('{}\t{}\t{}'.format(change, row_key, part_number))
+    print('{} added, {} removed, {} changed'.format(counts.get('added', 0), counts.get('removed', 0),
+                                                  counts.get('changed', 0)))
+finally:
+    session.close()
@@ -0,0 +1,44 @@
+# compute the perceptual hashes of the stored images and map near-duplicates to their canonical image
+# usage: python rebuild_phash_index.py [--drop-data]
+#   --drop-data  remove the BLOB of images mapped to a canonical image
+import sys
+from sqlalchemy.orm import sessionmaker
+from scrapy.utils.project import get_project_settings
+from sparepart.models import db_connect, image_classes
+from sparepart.helpers import read_image, image_phash
+from sparepart.phash import PHashIndex, format_phash
+
+COMMIT_EVERY = 500
+
+drop_data = '--drop-data' in sys.argv
+engine = db_connect()
+session = sessionmaker(bind=engine)()
+index = PHashIndex(get_project_settings().getint('IMAGE_DEDUPE_DISTANCE', 4))
+
+try:
+    for table, img_cls in image_classes().items():
+        duplicates = 0
+        rows = session.query(img_cls.id, img_cls.phash).filter(img_cls.canonical_id.is_(None)).\
+            order_by(img_cls.id).all()
+        for n, (image_id, phash) in enumerate(rows, 1):
+            phash = int(phash, 16) if phash else image_phash(read_image(session, img_cls, image_id))
+            if phash is None:
+                continue
+
+            values = {'phash': format_phash(phash)}
+            canonical = index.find(phash)
+            if canonical:
+                duplicates += 1
+                values.update({'canonical_table': canonical[0], 'canonical_id': canonical[1]})
+                if drop_data:
+                    values.update({'data': None, 'file_path': None, 'file_size': None})
+            else:
+                index.add(phash, table, image_id)
+            session.query(img_cls).filter_by(id=image_id).update(values, synchronize_session=False)
+
+            if n % COMMIT_EVERY == 0:
+                session.commit()
+        session.commit()
+        print('{}: {} images, {} near-duplicates'.format(table, len(rows), duplicates))
+finally:
+    session.close()
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+# compact set of the part keys already in the database, used by the merge write mode
+import math
+import hashlib
+import threading
+
+
+class BloomFilter(object):
+    """
+    Set membership test without false negatives: a key that was added is always found,
+    a key that was not is found with probability `error_rate` once `capacity` keys are added.
+    The keys are kept as bits in a bytearray, about 1.2 bytes per key at a 1% error rate.
+    """
+
+    def __init__(self, capacity=1000000, error_rate=0.01):
+        self.size = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, int(round(self.size / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.count
+
+    def positions(self, key):
+        # double hashing: the positions are h1 + i * h2 for the two halves of the md5 digest
+        digest = hashlib.md5(key.encode('utf-8')).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        positions = self.positions(key)
+        with self.lock:
+            for position in positions:
+                self.bits[position >> 3] |= 1 << (position & 7)
+            self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(key))
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+# dimension tables of the normalized schema (DB_NORMALIZED): vehicles, assembly sets and source urls
+import threading
+from collections import OrderedDict
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from .models import AssemblySet, SourceUrl
+from .helpers import row_digest
+
+
+def dimension_digest(values):
+    """md5 of the values of a dimension row, its natural key"""
+    return row_digest(values)
+
+
+def dimension_columns(dim_cls):
+    return [c.key for c in dim_cls.__table__.c if c.key not in ('id', 'digest')]
+
+
+class DimensionCache(object):
+    """
+    Ids of the dimension rows by table and digest, bounded to `max_size` entries (least recently used out).
+    A miss looks the row up in the database and inserts it when it does not exist yet.
+    """
+
+    def __init__(self, engine, max_size=100000):
+        self.engine = engine
+        self.max_size = max_size
+        self.ids = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def resolve(self, dim_cls, values):
+        """Return the id of the dimension row holding `values`"""
+        digest = dimension_digest(values)
+        key = (dim_cls.__tablename__, digest)
+        with self.lock:
+            if key in self.ids:
+                self.ids.move_to_end(key)
+                self.hits += 1
+                return self.ids[key]
+            self.misses += 1
+
+        table = dim_cls.__table__
+        dim_id = self.lookup(table, digest)
+        if dim_id is None:
+            try:
+                with self.engine.begin() as conn:
+                    dim_id = conn.execute(table.insert(), dict(values, digest=digest)).inserted_primary_key[0]
+            except IntegrityError:
+                # inserted meanwhile by another crawler process
+                dim_id = self.lookup(table, digest)
+
+        with self.lock:
+            self.ids[key] = dim_id
+            if len(self.ids) > self.max_size:
+                self.ids.popitem(last=False)
+        return dim_id
+
+    def lookup(self, table, digest):
+        with self.engine.connect() as conn:
+            return conn.execute(select([table.c.id]).where(table.c.digest == digest)).scalar()
+
+    def normalize(self, sparepart_cls, row):
+        """Return the part row with its vehicle, assembly set and source url values replaced by dimension ids"""
+        row = dict(row)
+        if sparepart_cls.vehicle_cls is not None:
+            columns = dimension_columns(sparepart_cls.vehicle_cls)
+            row['vehicle_id'] = self.resolve(sparepart_cls.vehicle_cls, {c: row.pop(c, None) for c in columns})
+        if sparepart_cls.assembly_columns:
+            values = dict.fromkeys(dimension_columns(AssemblySet))
+            for source, target in sparepart_cls.assembly_columns.items():
+                values[target] = row.pop(source, None)
+            row['assembly_id'] = self.resolve(AssemblySet, values)
+        if 'source_url' in row:
+            row['url_id'] = self.resolve(SourceUrl, {'url': row.pop('source_url')})
+        return row
+
+
+def denormalized_query(session, sparepart_cls):
+    """Query the rows of a part table as (part, vehicle, assembly set, source url) tuples"""
+    vehicle_cls = sparepart_cls.vehicle_cls
+    query = session.query(sparepart_cls, vehicle_cls, AssemblySet, SourceUrl).\
+        outerjoin(vehicle_cls, vehicle_cls.id == sparepart_cls.vehicle_id).\
+        outerjoin(AssemblySet, AssemblySet.id == sparepart_cls.assembly_id).\
+        outerjoin(SourceUrl, SourceUrl.id == sparepart_cls.url_id)
+    return query
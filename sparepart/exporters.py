@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+# streaming export sinks used by JsonPipeline
+import os
+import gzip
+import json
+import zipfile
+from io import BytesIO
+from scrapy.exporters import JsonLinesItemExporter
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+EXTENSIONS = {None: '', 'gzip': '.gz', 'zstd': '.zst'}
+ARCHIVE_INDEX = 'index.json'
+STORED_EXTENSIONS = ('.gz', '.zst', '.jpg', '.jpeg', '.png', '.gif', '.parquet')
+
+
+class JsonLinesSink(object):
+    """
+    JSON Lines export written in chunks: items are buffered and appended to the file on `flush`,
+    one gzip member or zstd frame per flush when compressed, so the file is valid after every flush.
+
+    After every flush the byte offset of the file is saved to `state_path` (if any). A job resumed
+    from its JOBDIR truncates the file to that checkpoint, dropping a partially written chunk, and appends.
+    """
+
+    def __init__(self, path, compression=None, fsync=True, state_path=None):
+        if compression not in EXTENSIONS:
+            raise ValueError('Unknown compression {}'.format(compression))
+        if compression == 'zstd' and zstandard is None:
+            raise ValueError('zstd compression requires the zstandard package')
+
+        self.compression = compression
+        self.fsync = fsync
+        self.state_path = state_path
+        self.items = 0
+        self.bytes_written = 0
+        self.resumed = False
+
+        state = self.load_state()
+        if state and os.path.exists(state['path']):
+            self.path = state['path']
+            self.items = state['items']
+            self.file = open(self.path, 'r+b')
+            self.file.truncate(state['offset'])
+            self.file.seek(state['offset'])
+            self.resumed = True
+        else:
+            self.path = path + EXTENSIONS[compression]
+            self.file = open(self.path, 'wb')
+            self.save_state()
+
+        self.buffer = BytesIO()
+        self.pending = 0
+        self.exporter = JsonLinesItemExporter(self.buffer, encoding='utf-8', ensure_ascii=False)
+        self.exporter.start_exporting()
+
+    def load_state(self):
+        if self.state_path and os.path.exists(self.state_path):
+            with open(self.state_path) as f:
+                return json.load(f)
+
+    def save_state(self):
+        if not self.state_path:
+            return
+        tmp_path = '{}.tmp'.format(self.state_path)
+        with open(tmp_path, 'w') as f:
+            json.dump({'path': self.path, 'offset': self.file.tell(), 'items': self.items}, f)
+        os.replace(tmp_path, self.state_path)
+
+    def export_item(self, item):
+        self.exporter.export_item(item)
+        self.pending += 1
+
+    def flush(self):
+        """Append the buffered items and record the checkpoint"""
+        if not self.pending:
+            return
+        data = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+
+        if self.compression == 'gzip':
+            data = gzip.compress(data)
+        elif self.compression == 'zstd':
+            data = zstandard.ZstdCompressor().compress(data)
+
+        self.file.write(data)
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+        self.bytes_written += len(data)
+        self.items += self.pending
+        self.pending = 0
+        self.save_state()
+
+    def close(self):
+        self.flush()
+        self.exporter.finish_exporting()
+        self.file.close()
+
+
+class ParquetSink(object):
+    """
+    Parquet export of one item class. Every field is a string column (lists and dicts as JSON),
+    dictionary encoded so repeated vehicle and assembly values are stored once per row group.
+
+    Rows are buffered and written as one row group every `row_group_size` items.
+    """
+
+    def __init__(self, path, item_cls, row_group_size=10000, compression='snappy'):
+        if pyarrow is None:
+            raise ValueError('Parquet export requires the pyarrow package')
+
+        self.path = path
+        self.fields = sorted(item_cls.fields)
+        self.schema = pyarrow.schema([(name, pyarrow.string()) for name in self.fields])
+        self.row_group_size = row_group_size
+        self.columns = {name: [] for name in self.fields}
+        self.pending = 0
+        self.items = 0
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema, compression=compression, use_dictionary=True)
+
+    def export_item(self, item):
+        for name in self.fields:
+            value = item.get(name)
+            if value is not None and not isinstance(value, str):
+                value = json.dumps(value, ensure_ascii=False, default=str)
+            self.columns[name].append(value)
+        self.pending += 1
+        if self.pending >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        table = pyarrow.Table.from_arrays([pyarrow.array(self.columns[name], type=pyarrow.string())
+                                           for name in self.fields], schema=self.schema)
+        self.writer.write_table(table, row_group_size=self.row_group_size)
+        self.items += self.pending
+        self.pending = 0
+        self.columns = {name: [] for name in self.fields}
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+def write_job_archive(path, files, images, images_store):
+    """
+    Pack a job output into one zip archive: `files` (the export and its manifest) under their base name
+    and `images` ({file name: image}) under images/<file name>, followed by an index.json mapping
+    every image checksum to its member.
+
+    Members are streamed from disk one at a time; already compressed data (images, gzip/zstd exports)
+    is stored, the rest deflated. Returns the size of the archive.
+    """
+    index = {'files': [], 'images': {}}
+    tmp_path = '{}.tmp'.format(path)
+    with zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as archive:
+        for file_path in files:
+            name = os.path.basename(file_path)
+            archive.write(file_path, name, compress_type=_compress_type(name))
+            index['files'].append(name)
+        for name, img in sorted(images.items()):
+            member = 'images/{}'.format(name)
+            archive.write(os.path.join(images_store, img['path']), member, compress_type=_compress_type(name))
+            index['images'][img.get('checksum') or name] = {'member': member, 'url': img.get('url'),
+                                                            'path': img['path']}
+        archive.writestr(ARCHIVE_INDEX, json.dumps(index, ensure_ascii=False))
+    os.replace(tmp_path, path)
+    return os.path.getsize(path)
+
+
+def read_archived_image(path, checksum):
+    """Return the data of one image of a job archive by checksum, or None"""
+    with zipfile.ZipFile(path) as archive:
+        entry = json.loads(archive.read(ARCHIVE_INDEX).decode('utf-8'))['images'].get(checksum)
+        if entry:
+            return archive.read(entry['member'])
+
+
+def _compress_type(name):
+    return zipfile.ZIP_STORED if name.lower().endswith(STORED_EXTENSIONS) else zipfile.ZIP_DEFLATED
@@ -1,35 +1,232 @@
 # -*- coding: utf-8 -*-
 # some useful helper function
+import re
+import json
+import hashlib
+import datetime
 import requests
 import logging
+import threading
+from decimal import Decimal, InvalidOperation
+from collections import OrderedDict
 from lxml.html import fromstring
-from .models import ImageMegazip
+from sqlalchemy import func, select, String
+from .models import ImageMegazip, image_classes
+from .imagestore import get_image_store
+from .phash import dhash, format_phash, get_phash_index
 
 logger = logging.getLogger('helpers')
 logging.addLevelName(35, "CRAWL_INFO")
 
-def get_or_create(session, img_cls, **kwargs):
-    """Get or Create an SQLAlchemy model instance.
+def create_image(session, img_cls, **kwargs):
+    """Insert a new image. The data comes from `data` (bytes handed over by the images pipeline)
+    or, as a fallback, from the downloaded file at `full_path`.
+
+    With the 'files' image backend the data is put in the content-addressed store and the row
+    only keeps its path and size. With IMAGE_DEDUPE a near-duplicate of an image already stored
+    keeps no data and points to that canonical image.
     """
-    instance = session.query(img_cls).filter_by(checksum=kwargs['checksum'], url=kwargs['url']).first()
-    if instance and 'force_create_new' not in kwargs:
-        return instance
+    source = kwargs['data'] if kwargs.get('data') is not None else kwargs['full_path']
+    store = get_image_store()
+    data = {'checksum': kwargs['checksum'], 'image_name': kwargs['image_name'],
+            'url': kwargs['url'],
+            'merk': kwargs['merk'], 'model': kwargs['model'],
+            'type': kwargs.get('type', None)}
+
+    phash_index = get_phash_index(session)
+    phash, canonical = None, None
+    if phash_index is not None:
+        source = b''.join(iter_chunks(source))
+        phash = image_phash(source)
+        if phash is not None:
+            data['phash'] = format_phash(phash)
+            canonical = phash_index.find(phash)
+
+    oracle = session.bind.dialect.name == 'oracle' and store is None and canonical is None
+    if canonical is not None:
+        data['canonical_table'], data['canonical_id'] = canonical
+    elif store is not None:
+        data['file_path'], data['file_size'] = store.put(kwargs['checksum'], iter_chunks(source))
     else:
-        data = {'checksum': kwargs['checksum'], 'image_name': kwargs['image_name'],
-                'url': kwargs['url'],
-                'data': read_file(kwargs['full_path']),
-                'merk': kwargs['merk'], 'model': kwargs['model'],
-                'type': kwargs.get('type', None)}
-        if 'id' in kwargs:
-            data['id'] = int(kwargs['id'])
-        if 'group' in kwargs:
-            data['group'] = kwargs['group']
-        if 'job_id' in kwargs:
-            data['job_id'] = kwargs['job_id']
-        instance = img_cls(**data)
-        session.add(instance)
-        session.flush()
-        return instance
+        data['data'] = func.empty_blob() if oracle else b''.join(iter_chunks(source))
+    if 'id' in kwargs:
+        data['id'] = int(kwargs['id'])
+    if 'group' in kwargs:
+        data['group'] = kwargs['group']
+    if 'job_id' in kwargs:
+        data['job_id'] = kwargs['job_id']
+    instance = img_cls(**data)
+    session.add(instance)
+    session.flush()
+    if oracle:
+        write_image_data(session, img_cls, instance.id, source)
+    if phash is not None and canonical is None:
+        phash_index.add(phash, img_cls.__tablename__, instance.id)
+    return instance
+
+
+def image_phash(data):
+    try:
+        return dhash(data)
+    except Exception as e:
+        logger.warning("perceptual hash failed. {} - {}".format(type(e), str(e)))
+
+
+def iter_chunks(source, chunk_size=65536):
+    """Yield bytes or the content of a file in chunks"""
+    if isinstance(source, (bytes, bytearray)):
+        for offset in range(0, len(source), chunk_size):
+            yield bytes(source[offset:offset + chunk_size])
+    else:
+        with open(source, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                yield chunk
+
+
+def raw_statement(session, stmt):
+    """Compile a statement for the DBAPI cursor of the session connection"""
+    compiled = stmt.compile(dialect=session.bind.dialect)
+    if compiled.positional:
+        return str(compiled), [compiled.params[k] for k in compiled.positiontup]
+    return str(compiled), compiled.params
+
+
+def write_image_data(session, img_cls, image_id, source, chunk_size=65536):
+    """Write the image data piecewise into the (empty) LOB of a freshly inserted image"""
+    table = img_cls.__table__
+    sql, params = raw_statement(session, select([table.c.data]).where(table.c.id == image_id).with_for_update())
+    cursor = session.connection().connection.cursor()
+    try:
+        cursor.execute(sql, params)
+        lob = cursor.fetchone()[0]
+        offset = 1  # LOB offsets are 1-based
+        for chunk in iter_chunks(source, chunk_size):
+            lob.write(chunk, offset)
+            offset += len(chunk)
+    finally:
+        cursor.close()
+
+
+def get_image_id(session, img_cls, checksum, url):
+    """Return the id of a stored image without loading its data"""
+    row = session.query(img_cls.id).filter_by(checksum=checksum, url=url).first()
+    if row:
+        return row.id
+
+
+def iter_image_data(session, img_cls, image_id, chunk_size=65536):
+    """Stream the BLOB of an image in chunks, for consumers that really need the bytes.
+
+    cx_Oracle returns a LOB locator when queried through the raw cursor, so the data is read
+    piecewise from the database instead of being materialized in one go.
+    """
+    table = img_cls.__table__
+    sql, params = raw_statement(session, select([table.c.data]).where(table.c.id == image_id))
+    cursor = session.connection().connection.cursor()
+    try:
+        cursor.execute(sql, params)
+        row = cursor.fetchone()
+        if not row or row[0] is None:
+            return
+        value = row[0]
+        if hasattr(value, 'read'):  # LOB locator
+            size = value.size()
+            offset = 1  # LOB offsets are 1-based
+            while offset <= size:
+                yield value.read(offset, chunk_size)
+                offset += chunk_size
+        else:
+            for chunk in iter_chunks(value, chunk_size):
+                yield chunk
+    finally:
+        cursor.close()
+
+
+def read_image(session, img_cls, image_id):
+    """Return the data of a stored image, from its canonical image, the content-addressed store or the BLOB"""
+    row = session.query(img_cls.file_path, img_cls.canonical_table, img_cls.canonical_id).\
+        filter_by(id=image_id).first()
+    if row and row.canonical_id is not None:
+        return read_image(session, image_classes()[row.canonical_table], row.canonical_id)
+    if row and row.file_path:
+        return get_image_store(force=True).get(row.file_path)
+    return b''.join(iter_image_data(session, img_cls, image_id))
+
+
+class ImageCache(object):
+    """
+    Process-local LRU cache mapping (image class, checksum, url) to the image primary key.
+    """
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, img_cls, checksum, url):
+        key = (img_cls, checksum, url)
+        with self.lock:
+            if key in self.data:
+                self.data.move_to_end(key)
+                self.hits += 1
+                return self.data[key]
+            self.misses += 1
+
+    def set(self, img_cls, checksum, url, image_id):
+        with self.lock:
+            self.data[(img_cls, checksum, url)] = image_id
+            self.data.move_to_end((img_cls, checksum, url))
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def warm(self, session, img_cls, merk=None, model=None):
+        """Load the ids of already stored images of a merk/model, newest first"""
+        query = session.query(img_cls.id, img_cls.checksum, img_cls.url)
+        if merk:
+            query = query.filter(func.lower(img_cls.merk) == merk.lower())
+        if model:
+            query = query.filter(func.lower(img_cls.model) == model.lower())
+        for image_id, checksum, url in reversed(query.order_by(img_cls.id.desc()).limit(self.maxsize).all()):
+            self.set(img_cls, checksum, url, image_id)
+
+
+def get_or_create_id(session, img_cls, cache=None, **kwargs):
+    """Get or Create an image and return its primary key, looking it up in the image cache first.
+    """
+    if cache is not None and 'force_create_new' not in kwargs:
+        image_id = cache.get(img_cls, kwargs['checksum'], kwargs['url'])
+        if image_id is not None:
+            return image_id
+
+    image_id = None
+    if 'force_create_new' not in kwargs:
+        image_id = get_image_id(session, img_cls, kwargs['checksum'], kwargs['url'])
+    if image_id is None:
+        image_id = create_image(session, img_cls, **kwargs).id
+    if cache is not None:
+        cache.set(img_cls, kwargs['checksum'], kwargs['url'], image_id)
+    return image_id
+
+
+PART_KEY_SEPARATORS = re.compile(r'[\s\-./_]+')
+
+
+def part_key(part_number):
+    """Part number comparable across brands: upper case without spaces and separators, None if empty"""
+    if not part_number:
+        return None
+    return PART_KEY_SEPARATORS.sub('', str(part_number)).upper()[:255] or None
+
+
+def row_digest(values):
+    """Stable md5 of the values of a row (dict or list), dates and numbers as strings"""
+    return hashlib.md5(json.dumps(values, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8')).hexdigest()
 
 
 def read_file(filename):
@@ -38,7 +235,136 @@ def read_file(filename):
     return file
 
 
-def remove_non_ascii(text):
+class AsciiTable(dict):
+    """str.translate table keeping ASCII characters and deleting the others it has no entry for,
+    filled on first use of each character"""
+
+    def __missing__(self, code):
+        value = self[code] = code if code < 128 else None
+        return value
+
+
+NON_ASCII_DELETE = AsciiTable()
+
+# non-ASCII characters with an ASCII equivalent, used with `transliterate`, the others are deleted
+ASCII_TRANSLATION = AsciiTable(str.maketrans({
+    '\xa0': ' ', '\u2002': ' ', '\u2003': ' ', '\u2009': ' ', '\u200b': '', '\u2010': '-', '\u2011': '-',
+    '\u2012': '-', '\u2013': '-', '\u2014': '-', '\u2018': "'", '\u2019': "'", '\u201c': '"', '\u201d': '"',
+    '\u2026': '...', '\u00d7': 'x', '\u00b0': 'deg', '\uff08': '(', '\uff09': ')'}))
+
+
+def remove_non_ascii(text, transliterate=False):
     if not text:
         return
-    return ''.join(i for i in text if ord(i) < 128)
+    try:
+        text.encode('ascii')
+        return text
+    except UnicodeEncodeError:
+        return text.translate(ASCII_TRANSLATION if transliterate else NON_ASCII_DELETE)
+
+
+class RowNormalizer(object):
+    """
+    Clean the rows of a model before they are written, compiled once from its String columns:
+    whitespace is collapsed, non-ASCII characters removed (`ascii_only`) or replaced by their ASCII
+    equivalent (`transliterate`), empty strings replaced by `no_value` and values longer than the column
+    cut to its length.
+
+    Calling it returns the row and the names of the truncated columns.
+    """
+
+    def __init__(self, model_cls, no_value='-', ascii_only=True, transliterate=False):
+        self.no_value = no_value
+        self.ascii_only = ascii_only
+        self.transliterate = transliterate
+        self.columns = [(prop.key, getattr(prop.columns[0].type, 'length', None))
+                        for prop in model_cls.__mapper__.column_attrs
+                        if isinstance(prop.columns[0].type, String)]
+
+    def __call__(self, row):
+        truncated = []
+        for key, length in self.columns:
+            value = row.get(key)
+            if value is None:
+                continue
+            if not isinstance(value, str):
+                value = str(value)
+            if self.ascii_only:
+                value = remove_non_ascii(value, self.transliterate) or ''
+            value = ' '.join(value.split()) or self.no_value
+            if length and len(value) > length:
+                value = value[:length]
+                truncated.append(key)
+            row[key] = value
+        return row, truncated
+
+
+NUMBER_PATTERN = re.compile(r'\d[\d.,]*')
+DATE_PATTERN = re.compile(r'(?<!\d)(?:'
+                          r'(?P<iso_y>(?:19|20)\d{2})-(?P<iso_m>\d{2})-(?P<iso_d>\d{2})|'
+                          r'(?P<dmy_d>\d{2})\.(?P<dmy_m>\d{2})\.(?P<dmy_y>(?:19|20)\d{2})|'
+                          r'(?P<ym_y>(?:19|20)\d{2})[./-]?(?P<ym_m>0[1-9]|1[0-2])|'
+                          r'(?P<my_m>0?[1-9]|1[0-2])[./](?P<my_y>(?:19|20)\d{2})'
+                          r')(?!\d)')
+
+
+def parse_price(value):
+    """Numeric value of a price string such as 'Rp 1.234.500', '$12.34' or '1,234.50', None if there is none.
+    A single separator followed by three digits is taken as a thousands separator.
+    """
+    if value is None or isinstance(value, (int, float, Decimal)):
+        return None if value is None else Decimal(str(value))
+    match = NUMBER_PATTERN.search(value)
+    if not match:
+        return None
+    number = match.group().rstrip('.,')
+    if ',' in number and '.' in number:
+        decimal_separator = '.' if number.rfind('.') > number.rfind(',') else ','
+        number = number.replace(',' if decimal_separator == '.' else '.', '').replace(decimal_separator, '.')
+    elif ',' in number or '.' in number:
+        separator = ',' if ',' in number else '.'
+        parts = number.split(separator)
+        number = number.replace(separator, '' if len(parts) > 2 or len(parts[-1]) == 3 else '.')
+    try:
+        return Decimal(number)
+    except InvalidOperation:
+        return None
+
+
+def parse_qty(value):
+    """First integer of a quantity string such as '2' or '(4)', None if there is none"""
+    if value is None or isinstance(value, int):
+        return value
+    match = re.search(r'\d+', str(value))
+    return int(match.group()) if match else None
+
+
+def parse_dates(value):
+    """Dates found in a string, e.g. '2004.09', '09/2004', '200409-201012', '2004-09-01' or '01.09.2004'.
+    Month precision values are the first day of the month.
+    """
+    if not value:
+        return []
+    dates = []
+    for match in DATE_PATTERN.finditer(str(value)):
+        groups = {k: v for k, v in match.groupdict().items() if v}
+        fmt = next(k.split('_')[0] for k in groups)
+        try:
+            dates.append(datetime.date(int(groups[fmt + '_y']), int(groups[fmt + '_m']),
+                                       int(groups.get(fmt + '_d', 1))))
+        except ValueError:
+            continue
+    return dates
+
+
+def parse_date(value):
+    dates = parse_dates(value)
+    return dates[0] if dates else None
+
+
+def parse_date_range(value):
+    """(from, to) dates of a production date range such as '200409-201012', missing ends are None"""
+    dates = parse_dates(value)
+    if len(dates) == 1 and str(value).strip()[:1] in '-~':
+        return None, dates[0]
+    return (dates[0] if dates else None), (dates[1] if len(dates) > 1 else None)
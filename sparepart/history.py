@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+# change history of the part rows and differences between two jobs, both keyed on the row hashes
+import datetime
+from sqlalchemy import select, and_, or_, bindparam
+from sqlalchemy.orm import aliased
+from .models import PartHistory
+
+
+class ChangeHistory(object):
+    """
+    Record the part rows of `sparepart_cls` whose tracked columns changed (their `tracked_hash`) in PartHistory
+    (DB_HISTORY).
+    `record` runs in the transaction of every batch of the writer, with one lookup of the open
+    versions per batch.
+    """
+
+    def __init__(self, sparepart_cls, stats=None, spider=None):
+        self.table = sparepart_cls.__table__
+        self.supersession_column = sparepart_cls.supersession_column
+        self.stats = stats
+        self.spider = spider
+
+    def record(self, conn, units, chunk_size=500):
+        rows = {}
+        for table, row, _ in units:
+            if table is self.table and row.get('row_key') and row.get('tracked_hash'):
+                rows[row['row_key']] = row
+
+        history = PartHistory.__table__
+        row_keys = list(rows)
+        current = {}
+        for start in range(0, len(row_keys), chunk_size):
+            query = select([history.c.row_key, history.c.id, history.c.content_hash]).\
+                where(and_(history.c.table_name == self.table.name, history.c.valid_to.is_(None),
+                           history.c.row_key.in_(row_keys[start:start + chunk_size])))
+            for row_key, history_id, content_hash in conn.execute(query):
+                current[row_key] = (history_id, content_hash)
+
+        now = datetime.datetime.now()
+        closed, versions = [], []
+        for row_key, row in rows.items():
+            previous = current.get(row_key)
+            if previous and previous[1] == row['tracked_hash']:
+                continue
+            if previous:
+                closed.append({'history_id': previous[0], 'closed_at': now})
+            versions.append({'table_name': self.table.name, 'row_key': row_key, 'job_id': row.get('job_id'),
+                             'change': 'changed' if previous else 'new', 'content_hash': row['tracked_hash'],
+                             'part_number': row.get('part_number'), 'price': row.get('price'),
+                             'price_value': row.get('price_value'), 'valid_from': now, 'valid_to': None,
+                             'supersession': row.get(self.supersession_column) if self.supersession_column else None})
+
+        if closed:
+            conn.execute(history.update().where(history.c.id == bindparam('history_id')).
+                         values(valid_to=bindparam('closed_at')), closed)
+        if versions:
+            conn.execute(history.insert(), versions)
+        self.inc_stats('history/new', len(versions) - len(closed))
+        self.inc_stats('history/changed', len(closed))
+
+    def inc_stats(self, key, count):
+        if self.stats and count:
+            self.stats.inc_value(key, count, spider=self.spider)
+
+
+def diff_jobs(session, sparepart_cls, job_a, job_b):
+    """
+    Differences between the part rows of two jobs as (change, row_key, part_number) tuples, change being
+    'added', 'removed' or 'changed'. The rows are joined on their indexed `row_key` and compared by
+    `tracked_hash`.
+    """
+    a, b = aliased(sparepart_cls), aliased(sparepart_cls)
+    changed = session.query(a.row_key, a.part_number, b.row_key).\
+        outerjoin(b, and_(b.row_key == a.row_key, b.job_id == job_b)).\
+        filter(a.job_id == job_a, a.row_key.isnot(None),
+               or_(b.row_key.is_(None), b.tracked_hash != a.tracked_hash))
+    for row_key, part_number, other_key in changed:
+        yield ('removed' if other_key is None else 'changed'), row_key, part_number
+
+    added = session.query(b.row_key, b.part_number).\
+        outerjoin(a, and_(a.row_key == b.row_key, a.job_id == job_a)).\
+        filter(b.job_id == job_b, b.row_key.isnot(None), a.row_key.is_(None))
+    for row_key, part_number in added:
+        yield 'added', row_key, part_number
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+# persistent index of downloaded images, shared by all spiders and jobs
+import os
+import time
+import sqlite3
+import threading
+from scrapy.utils.project import get_project_settings
+
+
+class ImageIndex(object):
+    """
+    Map image URL to its HTTP validators (ETag / Last-Modified), checksum, path and the id
+    of the stored image, using SQLite as persistent storage.
+    """
+
+    _sql_create = (
+        'CREATE TABLE IF NOT EXISTS `image_index` '
+        '(url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, checksum TEXT, path TEXT, '
+        'image_table TEXT, image_id INTEGER, checked REAL)'
+    )
+    _sql_get = ('SELECT url, etag, last_modified, checksum, path, image_table, image_id, checked '
+                'FROM `image_index` WHERE url = ?')
+    _sql_put = (
+        'INSERT OR REPLACE INTO `image_index` '
+        '(url, etag, last_modified, checksum, path, image_table, image_id, checked) '
+        'SELECT ?, ?, ?, ?, ?, image_table, image_id, ? FROM (SELECT 1) '
+        'LEFT JOIN `image_index` ON url = ? AND checksum = ?'
+    )
+    _sql_touch = 'UPDATE `image_index` SET checked = ? WHERE url = ?'
+    _sql_stored = 'UPDATE `image_index` SET image_table = ?, image_id = ? WHERE url = ? AND checksum = ?'
+    _sql_del = 'DELETE FROM `image_index` WHERE url = ?'
+
+    _fields = ('url', 'etag', 'last_modified', 'checksum', 'path', 'image_table', 'image_id', 'checked')
+
+    def __init__(self, path):
+        self._path = os.path.abspath(path)
+        os.makedirs(os.path.dirname(self._path), exist_ok=True)
+        # used from the reactor thread and from the database writer threads
+        self._db = sqlite3.Connection(self._path, timeout=60, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._db as conn:
+            # several crawler processes share the index
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(self._sql_create)
+
+    def get(self, url):
+        with self._lock:
+            row = self._db.execute(self._sql_get, (url,)).fetchone()
+        if row:
+            return dict(zip(self._fields, row))
+
+    def put(self, url, checksum, path, etag=None, last_modified=None):
+        """Record a downloaded image, the stored id is kept as long as the checksum is unchanged"""
+        with self._lock, self._db as conn:
+            conn.execute(self._sql_put, (url, etag, last_modified, checksum, path, time.time(), url, checksum))
+
+    def touch(self, url):
+        """Mark an image as checked now, e.g. after a 304 Not Modified"""
+        with self._lock, self._db as conn:
+            conn.execute(self._sql_touch, (time.time(), url))
+
+    def set_stored(self, url, checksum, image_table, image_id):
+        with self._lock, self._db as conn:
+            conn.execute(self._sql_stored, (image_table, image_id, url, checksum))
+
+    def delete(self, url):
+        with self._lock, self._db as conn:
+            conn.execute(self._sql_del, (url,))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_image_index():
+    """Return the process-wide image index, or None when IMAGE_INDEX_PATH is empty"""
+    global _index
+    path = get_project_settings().get('IMAGE_INDEX_PATH')
+    if not path:
+        return None
+    with _index_lock:
+        if _index is None:
+            _index = ImageIndex(path)
+        return _index
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+# content-addressed image store, an alternative to the BLOB column of the image tables
+import os
+import uuid
+import threading
+from collections import OrderedDict
+from scrapy.utils.project import get_project_settings
+
+
+class ContentAddressedStore(object):
+    """
+    Store every image once under `base_dir`, in a directory tree sharded by checksum,
+    e.g. checksum 'd41d8cd98f...' is stored at 'd4/1d/d41d8cd98f...'.
+
+    Storing an image that is already there writes nothing. Reads go through a small
+    LRU cache bounded by `cache_bytes`.
+    """
+
+    def __init__(self, base_dir, fanout=2, depth=2, cache_bytes=64 * 1024 * 1024):
+        self.base_dir = base_dir
+        self.fanout = fanout
+        self.depth = depth
+        self.cache_bytes = cache_bytes
+        self.cache = OrderedDict()
+        self.cache_size = 0
+        self.lock = threading.Lock()
+        os.makedirs(self.base_dir, exist_ok=True)
+
+    def relative_path(self, checksum):
+        shards = [checksum[i * self.fanout:(i + 1) * self.fanout] for i in range(self.depth)]
+        return '/'.join(shards + [checksum])
+
+    def full_path(self, relative_path):
+        return os.path.join(self.base_dir, *relative_path.split('/'))
+
+    def put(self, checksum, chunks):
+        """Store the chunks of an image unless its checksum is already present, returns (relative path, size)"""
+        relative_path = self.relative_path(checksum)
+        full_path = self.full_path(relative_path)
+        if os.path.exists(full_path):
+            return relative_path, os.path.getsize(full_path)
+
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        # write to a temporary name first so readers never see a partial file
+        tmp_path = '{}.{}.tmp'.format(full_path, uuid.uuid4().hex)
+        size = 0
+        with open(tmp_path, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+                size += len(chunk)
+        os.replace(tmp_path, full_path)
+        return relative_path, size
+
+    def get(self, relative_path):
+        """Read an image, served from the cache when possible"""
+        with self.lock:
+            if relative_path in self.cache:
+                self.cache.move_to_end(relative_path)
+                return self.cache[relative_path]
+
+        with open(self.full_path(relative_path), 'rb') as f:
+            data = f.read()
+
+        with self.lock:
+            if len(data) <= self.cache_bytes and relative_path not in self.cache:
+                self.cache[relative_path] = data
+                self.cache_size += len(data)
+                while self.cache_size > self.cache_bytes:
+                    _, evicted = self.cache.popitem(last=False)
+                    self.cache_size -= len(evicted)
+        return data
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_image_store(force=False):
+    """Return the process-wide content-addressed store, or None when images are kept as BLOBs.
+    `force` returns the store regardless of IMAGE_BACKEND, for reading rows stored earlier.
+    """
+    global _store
+    settings = get_project_settings()
+    if settings.get('IMAGE_BACKEND') != 'files' and not force:
+        return None
+    with _store_lock:
+        if _store is None:
+            _store = ContentAddressedStore(settings.get('IMAGE_FILES_STORE'),
+                                           fanout=settings.getint('IMAGE_FILES_FANOUT', 2),
+                                           depth=settings.getint('IMAGE_FILES_DEPTH', 2),
+                                           cache_bytes=settings.getint('IMAGE_FILES_CACHE_BYTES', 64 * 1024 * 1024))
+        return _store
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+# supersession / interchange graph of the part numbers of all brands
+import datetime
+import threading
+from collections import OrderedDict
+from sqlalchemy import select, bindparam
+from .models import PartSupersession, PartInterchange
+from .helpers import part_key
+
+
+class InterchangeIndex(object):
+    """
+    Record the supersessions of the part rows of `sparepart_cls` (DB_INTERCHANGE) in the transaction of every
+    batch of the writer, and fold them into PartInterchange: every part key of a connected group of
+    supersessions gets the same `group_key` and the end of its replacement chain as `latest_key`, so both
+    questions are answered by one indexed lookup.
+
+    Groups are small (a few supersessions), a batch only rewrites the rows of the groups its new edges touch.
+    The edges written by this process are remembered, up to `max_size` of them.
+    """
+
+    def __init__(self, sparepart_cls, stats=None, spider=None, max_size=1000000):
+        self.table = sparepart_cls.__table__
+        self.supersession_column = sparepart_cls.supersession_column
+        self.supersession_replaces = sparepart_cls.supersession_replaces
+        self.stats = stats
+        self.spider = spider
+        self.max_size = max_size
+        self.written = OrderedDict()
+        self.lock = threading.Lock()
+
+    def edge(self, row):
+        """(old key, new key) of the supersession of a part row, None if it has none"""
+        old, new = row.get('part_number'), row.get(self.supersession_column)
+        if self.supersession_replaces:
+            old, new = new, old
+        old_key, new_key = part_key(old), part_key(new)
+        if old_key and new_key and old_key != new_key:
+            return old_key, new_key
+
+    def record(self, conn, units):
+        edges = OrderedDict()
+        for table, row, _ in units:
+            edge = self.edge(row) if table is self.table else None
+            if edge:
+                edges[edge] = row.get('merk')
+        with self.lock:
+            edges = OrderedDict((edge, merk) for edge, merk in edges.items() if edge not in self.written)
+        if not edges:
+            return
+
+        supersessions = PartSupersession.__table__
+        existing = set(select_in(conn, [supersessions.c.old_key, supersessions.c.new_key], supersessions.c.old_key,
+                                 {old for old, new in edges}))
+        now = datetime.datetime.now()
+        new_edges = [{'old_key': old, 'new_key': new, 'merk': merk, 'created': now}
+                     for (old, new), merk in edges.items() if (old, new) not in existing]
+        if new_edges:
+            conn.execute(supersessions.insert(), new_edges)
+            self.link(conn, {key for edge in edges for key in edge}, now)
+        self.inc_stats('interchange/edges', len(new_edges))
+
+        with self.lock:
+            self.written.update((edge, True) for edge in edges)
+            while len(self.written) > self.max_size:
+                self.written.popitem(last=False)
+
+    def link(self, conn, keys, now):
+        """Recompute the groups and latest replacements of the groups of `keys`"""
+        supersessions, interchange = PartSupersession.__table__, PartInterchange.__table__
+        current = dict(select_in(conn, [interchange.c.part_key, interchange.c.group_key], interchange.c.part_key, keys))
+        groups = {current.get(key) or key for key in keys}
+        members = set(keys)
+        members.update(key for key, in select_in(conn, [interchange.c.part_key], interchange.c.group_key, groups))
+
+        successors, parent = {}, {key: key for key in members}
+        for old, new in select_in(conn, [supersessions.c.old_key, supersessions.c.new_key],
+                                  supersessions.c.old_key, members):
+            successors.setdefault(old, set()).add(new)
+            parent.setdefault(new, new)
+            old_root, new_root = find(parent, old), find(parent, new)
+            parent[max(old_root, new_root)] = min(old_root, new_root)
+
+        existing = set(current)
+        existing.update(key for key, in select_in(conn, [interchange.c.part_key], interchange.c.part_key,
+                                                  set(parent) - set(current)))
+        updated, inserted = [], []
+        for key in parent:
+            values = {'key': key, 'group_key': find(parent, key), 'latest_key': latest_key(key, successors),
+                      'replaced_by': max(successors[key]) if key in successors else None, 'updated': now}
+            (updated if key in existing else inserted).append(values)
+        if updated:
+            conn.execute(interchange.update().where(interchange.c.part_key == bindparam('key')).
+                         values(group_key=bindparam('group_key'), latest_key=bindparam('latest_key'),
+                                replaced_by=bindparam('replaced_by'), updated=bindparam('updated')), updated)
+        if inserted:
+            conn.execute(interchange.insert(), [dict(values, part_key=values.pop('key')) for values in inserted])
+
+    def inc_stats(self, key, count):
+        if self.stats and count:
+            self.stats.inc_value(key, count, spider=self.spider)
+
+
+def select_in(conn, columns, column, values, chunk_size=500):
+    """Rows of `columns` where `column` is in `values`, one query per chunk (Oracle takes 1000 values at most)"""
+    values, rows = list(values), []
+    for start in range(0, len(values), chunk_size):
+        rows.extend(tuple(row) for row in conn.execute(select(columns).where(column.in_(values[start:start + chunk_size]))))
+    return rows
+
+
+def find(parent, key):
+    """Root of a key in the union-find forest `parent`, the smallest key of its group"""
+    while parent[key] != key:
+        parent[key] = parent[parent[key]]
+        key = parent[key]
+    return key
+
+
+def latest_key(key, successors):
+    """End of the replacement chain of a key, the highest successor when a part has several"""
+    visited = {key}
+    while key in successors:
+        key = max(successors[key])
+        if key in visited:  # supersession cycle
+            break
+        visited.add(key)
+    return key
+
+
+def latest_replacement(conn, part_number):
+    """Normalized part number of the latest replacement of a part, the part itself if it has none"""
+    key = part_key(part_number)
+    keys = PartInterchange.__table__
+    row = conn.execute(select([keys.c.latest_key]).where(keys.c.part_key == key)).first()
+    return row[0] if row else key
+
+
+def equivalents(conn, part_number):
+    """Normalized part numbers interchangeable with a part (connected by supersessions), itself included"""
+    key = part_key(part_number)
+    part, other = PartInterchange.__table__.alias(), PartInterchange.__table__.alias()
+    query = select([other.c.part_key]).select_from(part.join(other, other.c.group_key == part.c.group_key)).\
+        where(part.c.part_key == key)
+    return sorted(row[0] for row in conn.execute(query)) or ([key] if key else [])
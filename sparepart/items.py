@@ -8,6 +8,14 @@
 import scrapy
 
 
+class AssemblySetItem(scrapy.Item):
+    """Illustrations of an assembly set page, stored once for all the parts of the page"""
+    assembly_set_url = scrapy.Field()
+    vehicle = scrapy.Field()  # page-level fields of the part items, e.g. merk, model, assembly_set
+    image_urls = scrapy.Field()
+    images = scrapy.Field()
+
+
 class IsuzuSparepartItem(scrapy.Item):
     # source_url
     source_url = scrapy.Field()
@@ -22,6 +30,7 @@ class IsuzuSparepartItem(scrapy.Item):
     assembly_set = scrapy.Field()  # e.g 'CYLINDER HEAD', 'FRONT BUMPER'
     image_urls = scrapy.Field()
     images = scrapy.Field()
+    assembly_set_url = scrapy.Field()  # source_url of the AssemblySetItem carrying the images
 
     # sparepart details
     key = scrapy.Field()
@@ -95,6 +104,7 @@ class MegazipItem(scrapy.Item):
     assembly_set = scrapy.Field()
     image_urls = scrapy.Field()
     images = scrapy.Field()
+    assembly_set_url = scrapy.Field()  # source_url of the AssemblySetItem carrying the images
 
     # sparepart details
     reference = scrapy.Field()
@@ -118,6 +128,7 @@ class SuzukiItem(scrapy.Item):
     assembly_set = scrapy.Field()  # e.g 'CYLINDER HEAD', 'CAMSHAFT & VALVE'
     image_urls = scrapy.Field()
     images = scrapy.Field()
+    assembly_set_url = scrapy.Field()  # source_url of the AssemblySetItem carrying the images
 
     # sparepart details
     id = scrapy.Field()
@@ -144,6 +155,7 @@ class DaihatsuItem(scrapy.Item):
     assembly_set = scrapy.Field()  # e.g 'FRONT HOOD', 'CAMSHAFT & VALVE'
     image_urls = scrapy.Field()
     images = scrapy.Field()
+    assembly_set_url = scrapy.Field()  # source_url of the AssemblySetItem carrying the images
 
     # sparepart details
     prod_date = scrapy.Field()
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+# latest state of the part tables per (merk, model), published when a job finishes successfully
+import datetime
+from sqlalchemy import select, and_
+from .models import LatestScope, LATEST_TABLES
+from .writers import column_row
+
+
+def job_scope(merk, model):
+    """Scope of the rows of a job: its lower-cased merk/model"""
+    return '{}/{}'.format(merk, model).lower()[:100]
+
+
+def latest_scope(spider):
+    return job_scope(spider.merk, spider.model)
+
+
+class LatestCatalog(object):
+    """
+    Rows of one job in the latest table of a part table (DB_LATEST).
+
+    The rows are written next to the part rows while the job runs and stay invisible to `latest_rows`
+    until `publish` points the scope to the job, in the transaction removing the rows of the previous job.
+    A job that did not finish has its rows removed by `discard`.
+    """
+
+    def __init__(self, sparepart_cls, scope, job_id):
+        self.sparepart_cls = sparepart_cls
+        self.table = LATEST_TABLES[sparepart_cls]
+        self.scope = scope
+        self.job_id = job_id
+
+    def row(self, sparepart):
+        row = {k: v for k, v in column_row(self.sparepart_cls, sparepart).items() if k in self.table.c}
+        row.update({'scope': self.scope, 'job_id': self.job_id})
+        return row
+
+    def publish(self, engine):
+        scopes = LatestScope.__table__
+        key = and_(scopes.c.table_name == self.table.name, scopes.c.scope == self.scope)
+        values = {'job_id': self.job_id, 'published': datetime.datetime.now()}
+        with engine.begin() as conn:
+            if not conn.execute(scopes.update().where(key), values).rowcount:
+                conn.execute(scopes.insert(), dict(values, table_name=self.table.name, scope=self.scope))
+            return conn.execute(self.table.delete().where(and_(self.table.c.scope == self.scope,
+                                                               self.table.c.job_id != self.job_id))).rowcount
+
+    def discard(self, engine):
+        with engine.begin() as conn:
+            return conn.execute(self.table.delete().where(and_(self.table.c.scope == self.scope,
+                                                               self.table.c.job_id == self.job_id))).rowcount
+
+
+def latest_rows(conn, sparepart_cls, scope):
+    """Rows of the published job of a scope in the latest table of a part table"""
+    table = LATEST_TABLES[sparepart_cls]
+    scopes = LatestScope.__table__
+    published = select([scopes.c.job_id]).where(and_(scopes.c.table_name == table.name,
+                                                     scopes.c.scope == scope)).as_scalar()
+    return conn.execute(select([table]).where(and_(table.c.scope == scope, table.c.job_id == published)))
@@ -7,6 +7,7 @@
 import random
 import logging
 import time
+from twisted.internet import reactor, task
 from scrapy.downloadermiddlewares.useragent import UserAgentMiddleware
 from scrapy.downloadermiddlewares.retry import RetryMiddleware
 from scrapy.utils.response import response_status_message
@@ -31,23 +32,46 @@ class TooManyRequestsRetryMiddleware(RetryMiddleware):
         pause_retry_429 = crawler.settings.getint('PAUSE_RETRY_429')
         self.pause_retry_429 = pause_retry_429 if pause_retry_429 else 10  # in minutes
         self.crawler = crawler
+        self.paused_until = {}  # download slot key -> timestamp when the slot may resume
 
     @classmethod
     def from_crawler(cls, crawler):
         return cls(crawler)
 
+    def pause_slot(self, request, spider):
+        """
+        Hold back the download slot of the request's domain for PAUSE_RETRY_429 minutes.
+        Only this slot is delayed, other slots, pipelines and stats keep running.
+        Returns the key of the slot and the number of seconds until it resumes.
+        """
+        now = time.time()
+        resume_at = now + 60 * self.pause_retry_429
+        key, slot = self.crawler.engine.downloader._get_slot(request, spider)
+        paused_until = max(self.paused_until.get(key, 0), now)
+        if resume_at > paused_until:
+            # the downloader delays a slot until `lastseen + delay`, so moving `lastseen`
+            # forward keeps the slot idle without touching the reactor
+            slot.lastseen = max(slot.lastseen, resume_at)
+            self.paused_until[key] = resume_at
+            self.crawler.stats.inc_value('retry_429/backoff_seconds', int(resume_at - paused_until), spider=spider)
+        self.crawler.stats.inc_value('retry_429/count', spider=spider)
+        return key, resume_at - now
+
     def process_response(self, request, response, spider):
         if request.meta.get('dont_retry', False):
             return response
         elif response.status == 429:
-            # self.crawler.engine.pause()
-            logger.warning('received status 429. Pausing process for {} minutes'.format(self.pause_retry_429))
-            time.sleep(60 * self.pause_retry_429)
-            # self.crawler.engine.unpause()
+            slot_key, backoff = self.pause_slot(request, spider)
+            logger.warning('received status 429. Pausing slot {} for {} minutes'.format(slot_key, self.pause_retry_429))
             reason = response_status_message(response.status)
-            logger.warning("retrying %(request)s because of  %(reason)s", {'request': request, 'reason': reason},
-                           extra={'spider': spider})
-            return self._retry(request, reason, spider) or response
+
+            def retry():
+                logger.warning("retrying %(request)s because of  %(reason)s", {'request': request, 'reason': reason},
+                               extra={'spider': spider})
+                return self._retry(request, reason, spider) or response
+
+            # re-queue the request once the slot resumes instead of sleeping in the reactor thread
+            return task.deferLater(reactor, backoff, retry)
         elif response.status in self.retry_http_codes:
             reason = response_status_message(response.status)
             logger.warning("retrying %(request)s because of  %(reason)s", {'request': request, 'reason': reason},
@@ -1,43 +1,267 @@
 import datetime
-from sqlalchemy import create_engine, Column, ForeignKey, Sequence
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship
-from sqlalchemy import (Integer, String, BLOB, Text, DateTime, CLOB, TEXT, TIMESTAMP)
+import threading
+import time
+from sqlalchemy import create_engine, inspect, Table, Column, ForeignKey, Sequence
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.ext.declarative import declarative_base, declared_attr
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.schema import CreateTable, CreateColumn
+from sqlalchemy.orm import relationship, deferred
+from sqlalchemy import (Integer, String, BLOB, Text, DateTime, CLOB, TEXT, TIMESTAMP, Numeric, Date)
 
 from scrapy.utils.project import get_project_settings
 
 DeclarativeBase = declarative_base()
 
 
-def db_connect():
+_engines = {}
+_engines_lock = threading.Lock()
+pool_stats = {'checkouts': 0, 'wait_time': 0.0, 'max_wait_time': 0.0}
+_pool_stats_lock = threading.Lock()
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool recording how long each checkout waited for a free connection"""
+
+    def _do_get(self):
+        start = time.time()
+        try:
+            return super(TimedQueuePool, self)._do_get()
+        finally:
+            wait_time = time.time() - start
+            # checkouts come from every writer thread
+            with _pool_stats_lock:
+                pool_stats['checkouts'] += 1
+                pool_stats['wait_time'] += wait_time
+                pool_stats['max_wait_time'] = max(pool_stats['max_wait_time'], wait_time)
+
+
+def db_connect(connection_string=None):
     """
     Performs database connection using database settings from settings.py.
-    Returns sqlalchemy engine instance
+    Returns sqlalchemy engine instance, shared by every caller in the process.
     """
-    return create_engine(get_project_settings().get("CONNECTION_STRING"), echo=True)
+    settings = get_project_settings()
+    connection_string = connection_string or settings.get("CONNECTION_STRING")
+    with _engines_lock:
+        if connection_string not in _engines:
+            options = {'echo': settings.getbool('DB_ECHO'), 'pool_pre_ping': settings.getbool('DB_POOL_PRE_PING')}
+            if make_url(connection_string).get_backend_name() != 'sqlite':
+                options.update({'poolclass': TimedQueuePool, 'pool_size': settings.getint('DB_POOL_SIZE', 5),
+                                'max_overflow': settings.getint('DB_MAX_OVERFLOW', 10)})
+            _engines[connection_string] = create_engine(connection_string, **options)
+        return _engines[connection_string]
+
+
+def export_pool_stats(stats, spider=None):
+    """Copy connection pool checkout statistics into the crawler stats"""
+    with _pool_stats_lock:
+        snapshot = dict(pool_stats)
+    stats.set_value('db_pool/checkouts', snapshot['checkouts'], spider=spider)
+    stats.set_value('db_pool/wait_time', round(snapshot['wait_time'], 3), spider=spider)
+    stats.set_value('db_pool/max_wait_time', round(snapshot['max_wait_time'], 3), spider=spider)
 
 
 def create_table(engine):
-    """Create new table from declarative base"""
+    """Create new table from declarative base, and the columns and indexes missing on the existing tables"""
     DeclarativeBase.metadata.create_all(engine)
+    inspector = inspect(engine)
+    for table in DeclarativeBase.metadata.sorted_tables:
+        add_columns(engine, table, {c['name'].lower() for c in inspector.get_columns(table.name)})
+        indexed = {tuple(index['column_names']) for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if tuple(c.name for c in index.columns) in indexed:
+                continue
+            try:
+                index.create(engine)
+            except DBAPIError as e:
+                print("{} - {}".format(type(e), str(e)))
+
+
+def add_columns(engine, table, existing):
+    """Add the (nullable) columns of a table missing in the database, e.g. columns of a newer version"""
+    preparer = engine.dialect.identifier_preparer
+    for column in table.columns:
+        if column.name.lower() in existing or column.primary_key:
+            continue
+        sql = 'ALTER TABLE {} ADD {}'.format(preparer.format_table(table), CreateColumn(column).compile(dialect=engine.dialect))
+        try:
+            engine.execute(sql)
+        except DBAPIError as e:
+            print("{} - {}".format(type(e), str(e)))
+
+
+@compiles(CreateTable, 'oracle')
+def create_table_oracle(element, compiler, **kw):
+    """One automatic list partition per job, so the rows of a job are dropped with its partition"""
+    sql = compiler.visit_create_table(element, **kw)
+    if element.element.info.get('partition_by_job') and get_project_settings().getbool('DB_PARTITION_BY_JOB'):
+        sql = "{}\nPARTITION BY LIST (job_id) AUTOMATIC (PARTITION p_none VALUES ('-'))\n\n".format(sql.rstrip())
+    if element.element.info.get('index_organized'):
+        # rows stored in the primary key index, its leading columns compressed
+        sql = "{}\nORGANIZATION INDEX COMPRESS {}\n\n".format(sql.rstrip(), element.element.info['index_organized'])
+    return sql
 
 
 class ImageMixin(object):
-    checksum = Column('checksum', String(32))
+    checksum = Column('checksum', String(32), index=True)
     url = Column('url', String(255))
-    data = Column('data', BLOB(length=2097152))
     image_name = Column('image_name', String(255))
     merk = Column('merk', String(50))
     model = Column('model', String(50))
     type = Column('type', String(50))
+    # set when IMAGE_BACKEND is 'files': the data lives in the content-addressed store, not in the BLOB
+    file_path = Column('file_path', String(255))
+    file_size = Column('file_size', Integer)
+    # perceptual hash (hex), near-duplicates keep no data and point to their canonical image
+    phash = Column('phash', String(16))
+    canonical_table = Column('canonical_table', String(50))
+    canonical_id = Column('canonical_id', Integer)
+
+    @declared_attr
+    def data(cls):
+        # the BLOB is only loaded when accessed, use helpers.iter_image_data to stream it
+        return deferred(Column('data', BLOB(length=2097152)))
+
+
+def image_classes():
+    """Image models by table name"""
+    return {cls.__tablename__: cls for cls in ImageMixin.__subclasses__()}
 
 
 class JobMixin(object):
-    job_id = Column('job_id', String(32), primary_key=True)
+    # with DB_PARTITION_BY_JOB new tables are list-partitioned by job on Oracle, see create_table_oracle
+    __table_args__ = {'info': {'partition_by_job': True}}
+
+    job_id = Column('job_id', String(32), primary_key=True, index=True)
+
+
+class DimensionMixin(object):
+    """Distinct set of values stored once and referenced by id from the part rows when DB_NORMALIZED is set"""
+    digest = Column('digest', String(32), unique=True)  # md5 of the values, see dimensions.dimension_digest
+
+    @declared_attr
+    def id(cls):
+        return Column(Integer, Sequence('{}_id_seq'.format(cls.__tablename__)), primary_key=True)
+
+
+class NormalizedMixin(object):
+    """
+    Dimension ids of a part row. With DB_NORMALIZED the vehicle, assembly set and source url columns
+    of the row are left empty and stored once in `vehicle_cls`, AssemblySet and SourceUrl.
+    `assembly_columns` maps the assembly columns of the part table to the AssemblySet columns.
+    """
+    vehicle_cls = None
+    assembly_columns = {}
+
+    vehicle_id = Column('vehicle_id', Integer, nullable=True)
+    assembly_id = Column('assembly_id', Integer, nullable=True)
+    url_id = Column('url_id', Integer, nullable=True)
+
+
+class RowHashMixin(object):
+    """
+    Hashes of a part row set by the pipelines: `row_key` of the values of its natural key columns
+    (`natural_key`, DB_MERGE_KEYS overrides it per table), `content_hash` of all its values and `tracked_hash`
+    of its tracked business columns (`tracked_columns` present in the table and the supersession column).
+    The merge write mode upserts on `row_key` and skips rows with an unchanged `content_hash`, the change
+    history and the job diffs compare `tracked_hash`.
+    """
+    natural_key = ('merk', 'model', 'assembly_set', 'part_number')
+    tracked_columns = ('part_name', 'description', 'price', 'qty')
+    # column of the superseding / superseded part number kept in the change history and the interchange
+    # index, if any, and whether the part of the row replaces it (else it replaces the part of the row)
+    supersession_column = None
+    supersession_replaces = False
+
+    row_key = Column('row_key', String(32), index=True)
+    content_hash = Column('content_hash', String(32))
+    tracked_hash = Column('tracked_hash', String(32))
+
+
+class PartKeyMixin(object):
+    """Part number normalized across brands (helpers.part_key), set by the pipelines"""
+    part_key = Column('part_key', String(255), index=True)
+
+
+class AssemblySet(DimensionMixin, DeclarativeBase):
+    __tablename__ = 'scraping_assembly_set'
+
+    section = Column('section', String(100))
+    group = Column('group', String(255))
+    assembly_set = Column('assembly_set', String(255))
+
+
+class SourceUrl(DimensionMixin, DeclarativeBase):
+    __tablename__ = 'scraping_source_url'
+
+    url = Column('url', String(255))
+
+
+class VehicleIsuzu(DimensionMixin, DeclarativeBase):
+    __tablename__ = 'scraping_vehicle_isuzu'
+
+    merk = Column('merk', String(50))
+    model_mobil = Column('model_mobil', String(50))
+    tipe_mobil = Column('tipe_mobil', String(50))
+
+
+class VehicleParts(DimensionMixin, DeclarativeBase):
+    __tablename__ = 'scraping_vehicle_parts'
+
+    merk = Column('merk', String(50))
+    model_year = Column('model_year', String(25))
+    model_mobil = Column('model_mobil', String(50))
+    submodel = Column('submodel', String(50))
+    engine = Column('engine', String(50))
+
+
+class VehicleMegazip(DimensionMixin, DeclarativeBase):
+    __tablename__ = 'scraping_vehicle_megazip'
+
+    merk = Column('merk', String(50))
+    varian = Column('varian', String(25))
+    model = Column('model', String(50))
+    vehicle_model = Column('vehicle_model', String(50))
+    model_mark = Column('model_mark', String(50))
+    model_year = Column('model_year', String(25))
+    frame = Column('frame', String(50))
+    grade = Column('grade', String(50))
+    body = Column('body', String(50))
+    engine = Column('engine', String(50))
+    transmission = Column('transmission', String(50))
+    destination = Column('destination', String(50))
+    from_date = Column('from_date', String(10))
+    to_date = Column('to_date', String(10))
+    gear_shift_type = Column('gear_shift_type', String(50))
+    seating_capacity = Column('seating_capacity', String(50))
+    fuel_induction = Column('fuel_induction', String(50))
+    drive = Column('drive', String(50))
+    door_number = Column('door_number', String(50))
+    note = Column('note', String(50))
+
 
+class VehicleSuzuki(DimensionMixin, DeclarativeBase):
+    __tablename__ = 'scraping_vehicle_suzuki'
 
-class SparepartIsuzu(JobMixin, DeclarativeBase):
+    merk = Column('merk', String(50))
+    model = Column('model', String(50))
+
+
+class VehicleDaihatsu(DimensionMixin, DeclarativeBase):
+    __tablename__ = 'scraping_vehicle_daihatsu'
+
+    merk = Column('merk', String(50))
+    model = Column('model', String(50))
+
+
+class SparepartIsuzu(JobMixin, NormalizedMixin, RowHashMixin, PartKeyMixin, DeclarativeBase):
     __tablename__ = "scraping_sparepart_isuzu"
+    natural_key = ('merk', 'model_mobil', 'tipe_mobil', 'main_group', 'assembly_set', 'key', 'part_number')
+    vehicle_cls = VehicleIsuzu
+    assembly_columns = {'main_group': 'group', 'assembly_set': 'assembly_set'}
 
     id = Column(Integer, Sequence('scraping_sparepart_isuzu_id_seq'), primary_key=True)
     merk = Column('merk', String(50))
@@ -46,11 +270,13 @@ class SparepartIsuzu(JobMixin, DeclarativeBase):
     main_group = Column('main_group', String(100))
     assembly_set = Column('assembly_set', String(255))
     key = Column('key_', String(10))
-    part_number = Column('part_number', String(255))
+    part_number = Column('part_number', String(255), index=True)
     itc = Column('itc', String(10))
     description = Column('description', String(255))
     qty = Column('qty', String(10))
+    qty_value = Column('qty_value', Integer)
     app_date = Column('app_date', String(10))
+    app_date_value = Column('app_date_value', Date)
     lr = Column('lr', String(10))
     model = Column('model', String(100))
     remarks = Column('remarks', String(255))
@@ -77,8 +303,12 @@ class ImageIsuzu(ImageMixin, DeclarativeBase):
     spareparts = relationship("ImageLinkIsuzu", back_populates="image")
 
 
-class SparepartParts(JobMixin, DeclarativeBase):
+class SparepartParts(JobMixin, NormalizedMixin, RowHashMixin, PartKeyMixin, DeclarativeBase):
     __tablename__ = "scraping_sparepart_parts"
+    natural_key = ('merk', 'model_year', 'model_mobil', 'submodel', 'engine', 'section', 'group', 'subgroup',
+                   'part_number')
+    vehicle_cls = VehicleParts
+    assembly_columns = {'section': 'section', 'group': 'group', 'subgroup': 'assembly_set'}
 
     id = Column(Integer, Sequence('scraping_sparepart_parts_id_seq'), primary_key=True)
     source_url = Column('source_url', String(255))
@@ -91,8 +321,9 @@ class SparepartParts(JobMixin, DeclarativeBase):
     group = Column('group', String(100))
     subgroup = Column('subgroup', String(100))
     part_name = Column('part_name', String(255))
-    part_number = Column('part_number', String(255))
+    part_number = Column('part_number', String(255), index=True)
     price = Column('price', String(100))
+    price_value = Column('price_value', Numeric(14, 2), index=True)
     description = Column('description', String(255))
     # images = relationship("ImageLinkParts", back_populates="sparepart")
     lookup_no = Column('lookup_no', String(50))
@@ -109,8 +340,14 @@ class ImageParts(ImageMixin, DeclarativeBase):
     # spareparts = relationship("ImageLinkParts", back_populates="image")
 
 
-class SparepartMegazip(JobMixin, DeclarativeBase):
+class SparepartMegazip(JobMixin, NormalizedMixin, RowHashMixin, PartKeyMixin, DeclarativeBase):
     __tablename__ = "scraping_sparepart_megazip"
+    natural_key = ('merk', 'model', 'frame', 'grade', 'body', 'engine', 'transmission', 'destination',
+                   'from_date', 'to_date', 'assembly_group', 'assembly_set', 'reference', 'part_number')
+    vehicle_cls = VehicleMegazip
+    assembly_columns = {'assembly_group': 'group', 'assembly_set': 'assembly_set'}
+    supersession_column = 'replacement_for'
+    supersession_replaces = True
 
     id = Column(Integer, Sequence('scraping_sparepart_megazip_id_seq'), primary_key=True)
     image_id = Column(Integer, ForeignKey('scraping_image_megazip.id'), nullable=True)
@@ -129,6 +366,8 @@ class SparepartMegazip(JobMixin, DeclarativeBase):
     destination = Column('destination', String(50))
     from_date = Column('from_date', String(10))
     to_date = Column('to_date', String(10))
+    from_date_value = Column('from_date_value', Date)
+    to_date_value = Column('to_date_value', Date)
     gear_shift_type = Column('gear_shift_type', String(50))
     transmission = Column('transmission', String(50))
     seating_capacity = Column('seating_capacity', String(50))
@@ -140,9 +379,10 @@ class SparepartMegazip(JobMixin, DeclarativeBase):
     assembly_set = Column('assembly_set', String(255))
     reference = Column('reference', String(25))
     part_name = Column('part_name', String(255))
-    part_number = Column('part_number', String(255))
+    part_number = Column('part_number', String(255), index=True)
     replacement_for = Column('replacement_for', String(255))
     price = Column('price', String(255))
+    price_value = Column('price_value', Numeric(14, 2), index=True)
     description = Column('description', String(255))
     image = relationship("ImageMegazip", back_populates="spareparts")
 
@@ -156,8 +396,12 @@ class ImageMegazip(ImageMixin, DeclarativeBase):
     spareparts = relationship("SparepartMegazip", back_populates="image")
 
 
-class SparepartSuzuki(JobMixin, DeclarativeBase):
+class SparepartSuzuki(JobMixin, NormalizedMixin, RowHashMixin, PartKeyMixin, DeclarativeBase):
     __tablename__ = "scraping_sparepart_suzuki"
+    natural_key = ('merk', 'model', 'group', 'assembly_set', 'tag_no', 'part_number')
+    vehicle_cls = VehicleSuzuki
+    assembly_columns = {'group': 'group', 'assembly_set': 'assembly_set'}
+    supersession_column = 'substitution_part_number'
 
     id = Column(Integer, primary_key=True, autoincrement=False)
     image_id = Column(Integer, nullable=True)
@@ -167,10 +411,12 @@ class SparepartSuzuki(JobMixin, DeclarativeBase):
     group = Column('group', String(50))
     assembly_set = Column('assembly_set', String(255))
     part_name = Column('part_name', String(255))
-    part_number = Column('part_number', String(255))
+    part_number = Column('part_number', String(255), index=True)
     substitution_part_number = Column('substitution_part_number', String(100))
     qty = Column('qty', String(10))
+    qty_value = Column('qty_value', Integer)
     price = Column('price', String(255))
+    price_value = Column('price_value', Numeric(14, 2), index=True)
     remarks = Column('remarks', String(255))
     tag_no = Column('tag_no', String(255))
     # image = relationship("ImageSuzuki", back_populates="spareparts")
@@ -187,8 +433,11 @@ class ImageSuzuki(ImageMixin, DeclarativeBase):
     # spareparts = relationship("SparepartSuzuki", back_populates="image")
 
 
-class SparepartDaihatsu(JobMixin, DeclarativeBase):
+class SparepartDaihatsu(JobMixin, NormalizedMixin, RowHashMixin, PartKeyMixin, DeclarativeBase):
     __tablename__ = "scraping_sparepart_daihatsu"
+    natural_key = ('merk', 'model', 'group', 'assembly_set', 'prod_date', 'part_number')
+    vehicle_cls = VehicleDaihatsu
+    assembly_columns = {'group': 'group', 'assembly_set': 'assembly_set'}
 
     id = Column(Integer, Sequence('scraping_sparepart_daihatsu_id_seq'), primary_key=True)
     image_id = Column(Integer, ForeignKey('scraping_image_daihatsu.id'), nullable=True)
@@ -198,9 +447,12 @@ class SparepartDaihatsu(JobMixin, DeclarativeBase):
     group = Column('group', String(50))
     assembly_set = Column('assembly_set', String(255))
     prod_date = Column('prod_date', String(100))
+    prod_date_from = Column('prod_date_from', Date)
+    prod_date_to = Column('prod_date_to', Date)
     part_name = Column('part_name', String(255))
-    part_number = Column('part_number', String(255))
+    part_number = Column('part_number', String(255), index=True)
     price = Column('price', String(255))
+    price_value = Column('price_value', Numeric(14, 2), index=True)
     image = relationship("ImageDaihatsu", back_populates="spareparts")
 
     def __repr__(self):
@@ -215,8 +467,11 @@ class ImageDaihatsu(ImageMixin, DeclarativeBase):
     spareparts = relationship("SparepartDaihatsu", back_populates="image")
 
 
-class SparepartDaihatsuPartSearch(JobMixin, DeclarativeBase):
+class SparepartDaihatsuPartSearch(JobMixin, NormalizedMixin, RowHashMixin, PartKeyMixin, DeclarativeBase):
     __tablename__ = "scraping_daihatsu_partsearch"
+    natural_key = ('merk', 'model', 'ref_no', 'models', 'spec_code', 'prod_date', 'part_number')
+    vehicle_cls = VehicleDaihatsu
+    supersession_column = 'substitution'
 
     id = Column(Integer, Sequence('scraping_daihatsu_partsearch_id_seq'), primary_key=True)
     source_url = Column('source_url', String(255))
@@ -224,18 +479,85 @@ class SparepartDaihatsuPartSearch(JobMixin, DeclarativeBase):
     model = Column('model', String(50))
     models = Column('models', String(100))
     prod_date = Column('prod_date', String(100))
+    prod_date_from = Column('prod_date_from', Date)
+    prod_date_to = Column('prod_date_to', Date)
     part_name = Column('part_name', String(255))
-    part_number = Column('part_number', String(255))
+    part_number = Column('part_number', String(255), index=True)
     spec_code = Column('spec_code', String(100))
     description = Column('description', String(255))
     ref_no = Column('ref_no', String(255))
     qty = Column('qty', String(10))
+    qty_value = Column('qty_value', Integer)
     rev_ref_fr = Column('rev_ref_fr', String(50))
     rev_ref_to = Column('rev_ref_to', String(50))
     weight = Column('weight', String(50))
     substitution = Column('substitution', String(255))
 
 
+class PartHistory(DeclarativeBase):
+    """
+    Versions of the part rows, by table and natural key (`row_key`): a version is recorded when the
+    content hash of a row differs from the open version (`valid_to` empty), which is then closed.
+    """
+    __tablename__ = 'scraping_part_history'
+
+    id = Column(Integer, Sequence('scraping_part_history_id_seq'), primary_key=True)
+    table_name = Column('table_name', String(50))
+    row_key = Column('row_key', String(32), index=True)
+    job_id = Column('job_id', String(32), index=True)
+    change = Column('change', String(10))  # 'new' or 'changed'
+    content_hash = Column('content_hash', String(32))  # tracked_hash of the part row
+    part_number = Column('part_number', String(255))
+    price = Column('price', String(255))
+    price_value = Column('price_value', Numeric(14, 2))
+    supersession = Column('supersession', String(255))
+    valid_from = Column('valid_from', TIMESTAMP)
+    valid_to = Column('valid_to', TIMESTAMP, nullable=True)
+
+
+class PartSupersession(DeclarativeBase):
+    """Supersession edges between normalized part numbers: `new_key` replaces `old_key`"""
+    __tablename__ = 'scraping_part_supersession'
+
+    old_key = Column('old_key', String(255), primary_key=True)
+    new_key = Column('new_key', String(255), primary_key=True)
+    merk = Column('merk', String(50))
+    created = Column('created', TIMESTAMP)
+
+
+class PartInterchange(DeclarativeBase):
+    """
+    Supersession graph by part key, maintained by interchange.InterchangeIndex: `group_key` identifies
+    the interchangeable parts (connected by supersessions), `latest_key` is the end of the replacement chain.
+    """
+    __tablename__ = 'scraping_part_interchange'
+
+    part_key = Column('part_key', String(255), primary_key=True)
+    group_key = Column('group_key', String(255), index=True)
+    replaced_by = Column('replaced_by', String(255))
+    latest_key = Column('latest_key', String(255))
+    updated = Column('updated', TIMESTAMP)
+
+
+class PartUsage(DeclarativeBase):
+    """
+    "Where used" postings maintained by whereused.WhereUsed: the vehicles and assembly sets (dimension ids)
+    of the rows of a part table by part key, with the first and last job they were seen in.
+    On Oracle the table is index organized on its primary key, part key and table name compressed.
+    """
+    __tablename__ = 'scraping_part_usage'
+    __table_args__ = {'info': {'index_organized': 2}}
+
+    part_key = Column('part_key', String(255), primary_key=True)
+    table_name = Column('table_name', String(50), primary_key=True)
+    vehicle_id = Column('vehicle_id', Integer, primary_key=True, autoincrement=False)
+    # 0 for the part tables without assembly sets
+    assembly_id = Column('assembly_id', Integer, primary_key=True, autoincrement=False)
+    first_job = Column('first_job', String(50))
+    last_job = Column('last_job', String(50))
+    last_seen = Column('last_seen', TIMESTAMP)
+
+
 class ScrapingJob(DeclarativeBase):
     __tablename__ = 'scraping_job'
 
@@ -249,3 +571,28 @@ class ScrapingJob(DeclarativeBase):
     log = Column('log', Text(length=1073741824), nullable=True)
     jobdir = Column('jobdir', String(100), nullable=True)
 
+
+class LatestScope(DeclarativeBase):
+    """Job whose rows are the published latest state of a (merk, model) scope in a latest table"""
+    __tablename__ = 'scraping_latest_scope'
+
+    table_name = Column('table_name', String(50), primary_key=True)
+    scope = Column('scope', String(100), primary_key=True)
+    job_id = Column('job_id', String(32))
+    published = Column('published', TIMESTAMP)
+
+
+def latest_table(sparepart_cls):
+    """
+    Table with the columns of a part table (but its generated id) plus the `scope` of the rows,
+    holding the rows of the last successful job of every scope, see latest.LatestCatalog.
+    """
+    table = sparepart_cls.__table__
+    name = table.name.replace('scraping_sparepart_', 'scraping_', 1).replace('scraping_', 'scraping_latest_', 1)
+    columns = [Column(c.name, c.type, index=c.index) for c in table.columns
+               if c.name != 'id' or c.autoincrement is False]
+    return Table(name, DeclarativeBase.metadata, Column('scope', String(100), index=True), *columns)
+
+
+LATEST_TABLES = {cls: latest_table(cls) for cls in (SparepartIsuzu, SparepartParts, SparepartMegazip, SparepartSuzuki,
+                                                     SparepartDaihatsu, SparepartDaihatsuPartSearch)}
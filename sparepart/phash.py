@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+# perceptual hashes of the illustrations, used to store near-duplicate images only once
+import threading
+from array import array
+from io import BytesIO
+from PIL import Image
+from scrapy.utils.project import get_project_settings
+from .models import image_classes
+
+
+def dhash(data, size=8):
+    """64-bit difference hash of an image: compares neighbouring pixels of a 9x8 grayscale thumbnail"""
+    image = Image.open(BytesIO(data)).convert('L').resize((size + 1, size), Image.ANTIALIAS)
+    pixels = list(image.getdata())
+    value = 0
+    for row in range(size):
+        for col in range(size):
+            offset = row * (size + 1) + col
+            value = value << 1 | (pixels[offset] > pixels[offset + 1])
+    return value
+
+
+def format_phash(value):
+    return '{:016x}'.format(value)
+
+
+class PHashIndex(object):
+    """
+    Near-duplicate lookup over 64-bit perceptual hashes, mapping a hash to its canonical image (table, id).
+
+    The hashes are kept in compact arrays. Two hashes within `distance` bits of each other are equal in
+    at least one of `distance + 1` bands (pigeonhole), so a lookup only compares the hashes sharing a band.
+    """
+
+    def __init__(self, distance=4):
+        self.distance = distance
+        bands = distance + 1
+        self.bands = [(i * 64 // bands, (i + 1) * 64 // bands) for i in range(bands)]
+        self.hashes = array('Q')
+        self.ids = array('q')
+        self.table_ids = array('B')
+        self.tables = []
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def band_keys(self, value):
+        for band, (start, end) in enumerate(self.bands):
+            yield band, (value >> start) & ((1 << (end - start)) - 1)
+
+    def add(self, value, table, image_id):
+        with self.lock:
+            if table not in self.tables:
+                self.tables.append(table)
+            position = len(self.hashes)
+            self.hashes.append(value)
+            self.ids.append(image_id)
+            self.table_ids.append(self.tables.index(table))
+            for key in self.band_keys(value):
+                self.buckets.setdefault(key, array('I')).append(position)
+
+    def find(self, value):
+        """Return (table, id) of the closest image within `distance` bits, or None"""
+        best, best_distance = None, self.distance + 1
+        with self.lock:
+            for key in self.band_keys(value):
+                for position in self.buckets.get(key, ()):
+                    distance = bin(self.hashes[position] ^ value).count('1')
+                    if distance < best_distance:
+                        best, best_distance = position, distance
+            if best is not None:
+                return self.tables[self.table_ids[best]], self.ids[best]
+
+    def load(self, session):
+        """Add the canonical images of all image tables, oldest first"""
+        for table, img_cls in image_classes().items():
+            query = session.query(img_cls.id, img_cls.phash).\
+                filter(img_cls.phash.isnot(None), img_cls.canonical_id.is_(None)).order_by(img_cls.id)
+            for image_id, phash in query:
+                self.add(int(phash, 16), table, image_id)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_phash_index(session):
+    """Return the process-wide perceptual hash index, loaded on first use, or None when IMAGE_DEDUPE is off"""
+    global _index
+    settings = get_project_settings()
+    if not settings.getbool('IMAGE_DEDUPE'):
+        return None
+    with _index_lock:
+        if _index is None:
+            index = PHashIndex(settings.getint('IMAGE_DEDUPE_DISTANCE', 4))
+            index.load(session)
+            _index = index
+        return _index
@@ -6,8 +6,17 @@
 # See: https://doc.scrapy.org/en/latest/topics/item-pipeline.html
 
 import os
+import json
+import time
 import datetime
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from twisted.internet import defer, reactor, task, threads
+from scrapy import signals
 from scrapy.pipelines.images import ImagesPipeline
+from scrapy.pipelines.files import FSFilesStore, FileException
+from scrapy.utils.misc import md5sum
 from shutil import copy2
 from pathlib import Path
 from sqlalchemy.orm import sessionmaker
@@ -15,8 +24,18 @@ from sqlalchemy.exc import IntegrityError
 from .models import SparepartIsuzu, ImageLinkIsuzu, ImageIsuzu, SparepartParts, ImageParts,\
     SparepartMegazip, ImageMegazip, SparepartSuzuki, ImageSuzuki, SparepartDaihatsu, SparepartDaihatsuPartSearch, ImageDaihatsu, \
     db_connect
-from .items import DaihatsuItem, DaihatsuPartSearchItem
-from .helpers import get_or_create
+from .items import AssemblySetItem, DaihatsuItem, DaihatsuPartSearchItem
+from .helpers import get_or_create_id, ImageCache, RowNormalizer, row_digest, parse_price, parse_qty, parse_date, parse_date_range, \
+    part_key
+from .writers import BatchWriter, MergeWriter, WriterPool
+from .dimensions import DimensionCache
+from .history import ChangeHistory
+from .whereused import WhereUsed
+from .latest import LatestCatalog, latest_scope
+from .interchange import InterchangeIndex
+from .imageindex import get_image_index
+from .transcode import transcode_image
+from .exporters import JsonLinesSink, ParquetSink, write_job_archive, pyarrow
 from scrapy.utils.project import get_project_settings
 from scrapy.exporters import JsonItemExporter
 
@@ -25,44 +44,78 @@ try:
 except ImportError:
     from io import BytesIO
 
-from PIL import Image
-
 import logging
 logger = logging.getLogger()
 
 IMAGES_STORE = get_project_settings().get("IMAGES_STORE")
+IMAGES_STORE_MODE = get_project_settings().get("IMAGES_STORE_MODE")
 NO_VALUE = '-'
 
 
-def save_image_relation_m2m(session, img_cls, img_link_cls, img):
+class ImageBuffer(object):
     """
-    Add image Many 2 Many relation for sparepart
+    Bytes of downloaded images waiting for the DB pipelines, keyed by image path.
+    Holds at most `max_bytes`: `put` returns the oldest images beyond that, which the caller writes
+    to IMAGES_STORE before it `discard`s them.
     """
 
-    # save images to database
-    imagelink = img_link_cls()
-    full_path = '{}/{}'.format(IMAGES_STORE, img['path'])
-    img.update({'full_path': full_path})
-    imagelink.image = get_or_create(session, img_cls, **img)
-
-    # remove downloaded images
-    try:
-        os.remove(full_path)
-        pass
-    except:
-        logger.debug('remove image failed.')
-
-    return imagelink
-
-def save_image(session, img_cls, img):
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def put(self, path, data):
+        """Keep the bytes of an image, returns the (path, data) of the images over the limit, oldest first"""
+        with self.lock:
+            if len(data) > self.max_bytes:
+                return [(path, data)]
+            self.size += len(data) - len(self.data.pop(path, b''))
+            self.data[path] = data
+            spilled, size = [], self.size
+            for old_path, old_data in self.data.items():
+                if size <= self.max_bytes:
+                    break
+                spilled.append((old_path, old_data))
+                size -= len(old_data)
+            return spilled
+
+    def discard(self, path, data):
+        """Remove an image once written to IMAGES_STORE, unless it was popped or replaced meanwhile"""
+        with self.lock:
+            if self.data.get(path) is data:
+                del self.data[path]
+                self.size -= len(data)
+
+    def pop(self, path):
+        with self.lock:
+            data = self.data.pop(path, None)
+            if data is not None:
+                self.size -= len(data)
+            return data
+
+
+IMAGE_BUFFER = ImageBuffer(get_project_settings().getint("IMAGES_MEMORY_MAX_BYTES"))
+
+
+def save_image(session, img_cls, img, cache=None):
     """
-    Save image to database
+    Save image to database, returns the image id
     """
 
-    # save images to database
+    # save images to database, using the bytes kept in memory by the images pipeline if any
     full_path = '{}/{}'.format(IMAGES_STORE, img['path'])
     img.update({'full_path': full_path})
-    image = get_or_create(session, img_cls, **img)
+    image_index = get_image_index()
+    try:
+        image_id = get_or_create_id(session, img_cls, cache, data=IMAGE_BUFFER.pop(img['path']), **img)
+    except (IOError, OSError):
+        # the download was skipped by the image index but the image is no longer stored
+        if image_index:
+            image_index.delete(img['url'])
+        raise
+    if image_index:
+        image_index.set_stored(img['url'], img['checksum'], img_cls.__tablename__, image_id)
 
     # remove downloaded images
     try:
@@ -71,377 +124,557 @@ def save_image(session, img_cls, img):
     except:
         logger.debug('remove failed for {}'.format(full_path))
 
-    return image
+    return image_id
 
 
 class BasePipeline(object):
+    item_cls = None
+    sparepart_cls = None
+    image_cls = None
+    image_cache = None
+    writer = None
+    writer_pool = None
+    flush_loop = None
+    dimensions = None
+    natural_key = None
+    tracked_columns = ()
+    normalizer = None
+    latest = None
+    normalized = False
+
     def __init__(self):
         """
         Initializes database connection and sessionmaker.
         """
         if os.environ.get('CONNECTION_STRING'):
-            engine = db_connect()
-            self.Session = sessionmaker(bind=engine)
-
-
-class SparepartIsuzuPipeline(BasePipeline):
-
-    def process_item(self, item, spider):
-        """Save isuzu spareparts in the database.
-
-        This method is called for every item pipeline component.
-        """
-
-        if os.environ.get('SAVE_AS_JSON'):
-            return item
+            self.engine = db_connect()
+            self.Session = sessionmaker(bind=self.engine)
 
+    def open_spider(self, spider):
+        if os.environ.get('SAVE_AS_JSON') or not hasattr(self, 'engine'):
+            return
+
+        stats = spider.crawler.stats
+        options = {'batch_size': spider.settings.getint('DB_BATCH_SIZE', 500),
+                   'batch_interval': spider.settings.getfloat('DB_BATCH_INTERVAL', 10), 'stats': stats, 'spider': spider}
+        merge = spider.settings.get('DB_WRITE_MODE', 'insert') == 'merge' and self.sparepart_cls is not None
+        options['recorders'] = []
+        if spider.settings.getbool('DB_HISTORY') and self.sparepart_cls is not None:
+            options['recorders'].append(ChangeHistory(self.sparepart_cls, stats, spider))
+        if spider.settings.getbool('DB_INTERCHANGE') and self.sparepart_cls is not None and \
+                self.sparepart_cls.supersession_column:
+            options['recorders'].append(InterchangeIndex(self.sparepart_cls, stats, spider))
+        if spider.settings.getbool('DB_WHERE_USED') and self.sparepart_cls is not None:
+            options['recorders'].append(WhereUsed(self.sparepart_cls, stats, spider,
+                                                  spider.settings.getint('DB_WHERE_USED_CACHE_SIZE', 1000000)))
+        if merge:
+            self.writer = MergeWriter(self.engine, spider.settings.getint('DB_MERGE_BLOOM_CAPACITY', 1000000),
+                                      spider.settings.getfloat('DB_MERGE_BLOOM_ERROR_RATE', 0.01), **options)
+        else:
+            self.writer = BatchWriter(self.engine, **options)
+        if self.sparepart_cls is not None:
+            merge_keys = json.loads(spider.settings.get('DB_MERGE_KEYS') or '{}')
+            self.natural_key = merge_keys.get(self.sparepart_cls.__tablename__, self.sparepart_cls.natural_key)
+            tracked = self.sparepart_cls.tracked_columns + (self.sparepart_cls.supersession_column,)
+            self.tracked_columns = [c for c in tracked if c and c in self.sparepart_cls.__table__.c]
+            self.normalizer = RowNormalizer(self.sparepart_cls, NO_VALUE, spider.settings.getbool('DB_ASCII_ONLY', True),
+                                            spider.settings.getbool('DB_ASCII_TRANSLITERATE'))
+        self.writer_pool = WriterPool(threads=spider.settings.getint('DB_WRITER_THREADS', 1),
+                                      max_pending=spider.settings.getint('DB_WRITER_MAX_PENDING', 100),
+                                      stats=stats, spider=spider, name=self.__class__.__name__)
+        self.writer_pool.start()
+        self.flush_loop = task.LoopingCall(self.writer_pool.run, self.writer.flush_expired)
+        self.flush_loop.start(self.writer.batch_interval, now=False)
+
+        self.image_cache = ImageCache(spider.settings.getint('IMAGE_CACHE_SIZE', 10000))
+        self.normalized = spider.settings.getbool('DB_NORMALIZED')
+        if self.normalized or spider.settings.getbool('DB_WHERE_USED'):
+            self.dimensions = DimensionCache(self.engine, spider.settings.getint('DB_DIMENSION_CACHE_SIZE', 100000))
+        # image ids of the assembly sets saved lately and the parts waiting for them (with their timeout), by page url
+        self.assembly_images = OrderedDict()
+        self.assembly_waiters = {}
+        self.assembly_cache_size = spider.settings.getint('ASSEMBLY_IMAGES_CACHE_SIZE', 1000)
+        self.assembly_wait_timeout = spider.settings.getfloat('ASSEMBLY_WAIT_TIMEOUT', 600)
+        if self.image_cls:
+            spider.crawler.signals.connect(self.assembly_set_lost, signal=signals.item_dropped)
+            spider.crawler.signals.connect(self.assembly_set_lost, signal=signals.item_error)
+        if spider.settings.getbool('DB_LATEST') and self.sparepart_cls is not None and hasattr(spider, '_job'):
+            self.latest = LatestCatalog(self.sparepart_cls, latest_scope(spider), spider._job)
+            spider.crawler.signals.connect(self.publish_latest, signal=signals.spider_closed)
+
+        warmed = []
+        if merge:
+            warmed.append(self.writer_pool.run(self.writer.load_keys, self.sparepart_cls.__table__))
+        if self.image_cls:
+            warmed.append(self.writer_pool.run(self.warm_image_cache, spider))
+        if warmed:
+            return defer.DeferredList(warmed)
+
+    def warm_image_cache(self, spider):
         session = self.Session()
-        sparepart = SparepartIsuzu(**{'job_id': spider._job})
-        sparepart.merk = item["merk"]
-        sparepart.model_mobil = item["model_mobil"]
-        sparepart.tipe_mobil = item["tipe_mobil"]
-        sparepart.main_group = item["main_group"]
-        sparepart.assembly_set = item["assembly_set"]
-        sparepart.key = item["key"]
-        sparepart.part_number = item["part_number"]
-        sparepart.itc = item["itc"]
-        sparepart.description = item["description"]
-        sparepart.qty = item["qty"]
-        sparepart.app_date = item["app_date"]
-        sparepart.lr = item["lr"]
-        sparepart.model = item["model"]
-        sparepart.remarks = item["remarks"]
-        sparepart.source_url = item["source_url"]
-
         try:
-
-            # save images relation
-            try:
-                for img in item.get("images", None):
-                    img.update({'image_name': item['assembly_set'],
-                                'merk': item['merk'], 'model': item['model_mobil'], 'type': item['tipe_mobil'], })
-                    imagelink = save_image_relation_m2m(session, ImageIsuzu, ImageLinkIsuzu, img)
-                    sparepart.images.append(imagelink)
-
-            except Exception as e:
-                spider.logger.warning("{} - {}".format(type(e), str(e)))
-
-            session.add(sparepart)
-            session.commit()
-
-        except IntegrityError as e:
-            spider.logger.warning("IntegrityError Exception. {} - {}".format(type(e), str(e)))
-            session.rollback()
+            self.image_cache.warm(session, self.image_cls, getattr(spider, 'merk', None), getattr(spider, 'model', None))
+            spider.logger.debug('image cache warmed with {} images'.format(len(self.image_cache.data)))
         except Exception as e:
-            spider.logger.error("EXCEPTION... {} - {}".format(type(e), str(e)))
-            session.rollback()
-            # raise
+            spider.logger.warning("warming image cache failed. {} - {}".format(type(e), str(e)))
         finally:
             session.close()
 
-        return item
-
-
-class SparepartPartsPipeline(BasePipeline):
+    def close_spider(self, spider):
+        if self.flush_loop and self.flush_loop.running:
+            self.flush_loop.stop()
+        if self.writer_pool:
+            # parts still waiting for an assembly set are saved without its images
+            for url in list(self.assembly_waiters):
+                self.release_waiters(url, [])
+            # let the queued items reach the buffer before the last flush
+            d = defer.DeferredList(list(self.writer_pool.pending))
+            d.addBoth(lambda _: self.writer_pool.run(self.writer.flush))
+            d.addBoth(lambda _: self.writer_pool.close())
+            d.addBoth(lambda _: self.export_stats(spider))
+            return d
+
+    def publish_latest(self, spider, reason):
+        """
+        Make the rows of the job the latest state of its scope if it finished with all its items written,
+        drop them otherwise
+        """
+        stats = spider.crawler.stats
+        lost = sum(stats.get_value(key, 0, spider=spider) for key in
+                   ('db_writer/failed_rows', 'db_writer/failed_items', 'db_writer/integrity_error',
+                    'item_dropped_count'))
+        if reason == 'finished' and not lost:
+            d = threads.deferToThread(self.latest.publish, self.engine)
+            message = '{} rows of previous jobs replaced in ' + self.latest.table.name
+        else:
+            d = threads.deferToThread(self.latest.discard, self.engine)
+            message = '{} rows of the unfinished or incomplete job removed from ' + self.latest.table.name
+        d.addCallback(lambda count: spider.logger.log(spider.log_lvl, message.format(count)))
+        d.addErrback(lambda failure: spider.logger.error('updating {} failed. {} - {}'.format(
+            self.latest.table.name, failure.type, str(failure.value))))
+        return d
+
+    def export_stats(self, spider):
+        if self.image_cls:
+            spider.crawler.stats.set_value('image_cache/hits', self.image_cache.hits, spider=spider)
+            spider.crawler.stats.set_value('image_cache/misses', self.image_cache.misses, spider=spider)
+        if self.dimensions:
+            spider.crawler.stats.set_value('dimension_cache/hits', self.dimensions.hits, spider=spider)
+            spider.crawler.stats.set_value('dimension_cache/misses', self.dimensions.misses, spider=spider)
 
     def process_item(self, item, spider):
+        """Hand the item to the writer thread pool, the returned Deferred fires with the item once it is saved"""
         if os.environ.get('SAVE_AS_JSON'):
             return item
 
-        session = self.Session()
-        sparepart = SparepartParts(**{'job_id': spider._job})
-        sparepart.merk = item.get("merk") if item.get("merk") != '' else NO_VALUE
-        sparepart.model_year = item.get("model_year") if item.get("model_year") != '' else NO_VALUE
-        sparepart.model_mobil = item.get("model_mobil") if item.get("model_mobil") != '' else NO_VALUE
-        sparepart.submodel = item.get("submodel") if item.get("submodel") != '' else NO_VALUE
-        sparepart.engine = item.get("engine") if item.get("engine") != '' else NO_VALUE
-        sparepart.section = item.get("section") if item.get("section") != '' else NO_VALUE
-        sparepart.group = item.get("group") if item.get("group") != '' else NO_VALUE
-        sparepart.subgroup = item.get("subgroup") if item.get("subgroup") != '' else NO_VALUE
-        sparepart.part_name = item.get("part_name") if item.get("part_name") != '' else NO_VALUE
-        sparepart.part_number = item.get("part_number") if item.get("part_number") != '' else NO_VALUE
-        sparepart.price = item.get("price") if item.get("price") != '' else NO_VALUE
-        sparepart.description = item.get("description") if item.get("description") != '' else NO_VALUE
-        sparepart.source_url = item.get("source_url") if item.get("source_url") != '' else NO_VALUE
-        sparepart.lookup_no = item.get("lookup_no") if item.get("lookup_no") != '' else NO_VALUE
-
-        try:
-
-            # save images relation
-            try:
-                if 'images' in item:
-                    for img in item.get("images"):
-                        img.update({'image_name': sparepart.subgroup, 'merk': sparepart.merk,
-                                    'model': sparepart.model_mobil, 'type': sparepart.submodel})
-                        image = save_image(session, ImageParts, img)
-                        sparepart.image_id = image.id
+        if isinstance(item, AssemblySetItem):
+            if not self.image_cls:
+                return item
+            d = self.writer_pool.run(self.save_assembly_set, item, spider)
+            d.addBoth(self.assembly_set_saved, item['assembly_set_url'])
+            return d.addCallback(lambda _: item)
 
-            except Exception as e:
-                spider.logger.warning("{} - {}".format(type(e), str(e)))
-
-            session.add(sparepart)
-            session.commit()
+        if self.item_cls and not isinstance(item, self.item_cls):
+            return item
 
-        except IntegrityError as e:
-            spider.logger.warning("IntegrityError Exception. {} - {}".format(type(e), str(e)))
-            session.rollback()
+        if item.get('assembly_set_url'):
+            # parts of a page wait for the images of their assembly set
+            d = self.assembly_set_images(item['assembly_set_url'])
+            return d.addCallback(lambda image_ids: self.writer_pool.run(self.save_item, item, spider, image_ids))
+
+        return self.writer_pool.run(self.save_item, item, spider)
+
+    def build_sparepart(self, item, spider):
+        """Return the row of the sparepart table for an item"""
+        raise NotImplementedError
+
+    def prepare(self, item, spider):
+        """Build the row of an item and clean it to fit the sparepart table, counting the truncated values"""
+        sparepart, truncated = self.normalizer(self.build_sparepart(item, spider))
+        for column in truncated:
+            spider.crawler.stats.inc_value('normalize/truncated/{}'.format(column), spider=spider)
+        sparepart['part_key'] = part_key(sparepart.get('part_number'))
+        return sparepart
+
+    def image_info(self, sparepart):
+        """Return the fields of the image rows of a sparepart"""
+        raise NotImplementedError
+
+    def image_links(self, sparepart, image_ids):
+        """Link the sparepart row to its images, returns the child rows for the writer if any"""
+        if image_ids:
+            sparepart['image_id'] = image_ids[-1]
+
+    def write_row(self, sparepart, links=None):
+        """Hand a part row to the writer, and to the latest table with DB_LATEST"""
+        sparepart = self.normalize(self.identify(sparepart))
+        self.writer.add(self.sparepart_cls, sparepart, links)
+        if self.latest:
+            self.writer.add(self.latest.table, self.latest.row(sparepart))
+
+    def identify(self, sparepart):
+        """Set the hash of the natural key, the content hash and the tracked columns hash of a part row"""
+        sparepart['row_key'] = row_digest([sparepart.get(column) for column in self.natural_key])
+        sparepart['tracked_hash'] = row_digest([sparepart.get(column) for column in self.tracked_columns])
+        sparepart['content_hash'] = row_digest({k: v for k, v in sparepart.items()
+                                                if k not in ('id', 'job_id', 'row_key', 'content_hash', 'tracked_hash')})
+        return sparepart
+
+    def normalize(self, sparepart):
+        """
+        Set the dimension ids of a part row, with DB_NORMALIZED replacing its vehicle, assembly set and url values.
+        Without DB_NORMALIZED the ids are only resolved for the "where used" postings (DB_WHERE_USED).
+        """
+        if not self.dimensions:
+            return sparepart
+        if self.normalized:
+            return self.dimensions.normalize(self.sparepart_cls, sparepart)
+        ids = self.dimensions.normalize(self.sparepart_cls, {k: v for k, v in sparepart.items() if k != 'source_url'})
+        sparepart.update((k, ids.get(k)) for k in ('vehicle_id', 'assembly_id'))
+        return sparepart
+
+    def save_images(self, session, images, sparepart, spider):
+        image_ids = []
+        try:
+            for img in images:
+                img.update(self.image_info(sparepart))
+                image_ids.append(save_image(session, self.image_cls, img, self.image_cache))
         except Exception as e:
-            spider.logger.error("EXCEPTION... {} - {}".format(type(e), str(e)))
-            session.rollback()
-            # raise
-        finally:
-            session.close()
-
-        return item
-
+            spider.logger.warning("{} - {}".format(type(e), str(e)))
+        return image_ids
 
-class SparepartMegazipPipeline(BasePipeline):
-
-    def process_item(self, item, spider):
-        if os.environ.get('SAVE_AS_JSON'):
-            return item
+    def save_item(self, item, spider, image_ids=None):
+        """Save a sparepart in the database, with the images of the item or,
+        for parts of an assembly set, with the ids of the assembly set images.
 
+        This method runs on the writer thread pool.
+        """
         session = self.Session()
-        sparepart = SparepartMegazip(**{'job_id': spider._job})
-
-        sparepart.merk = item.get("merk") if item.get("merk") != '' else NO_VALUE
-        sparepart.varian = item.get("varian") if item.get("varian") != '' else NO_VALUE
-        sparepart.model_year = item.get("model_year") if item.get("model_year") != '' else NO_VALUE
-        sparepart.sales_region = item.get("sales_region") if item.get("sales_region") != '' else NO_VALUE
-        sparepart.frame = item.get("frame") if item.get("frame") != '' else NO_VALUE
-        sparepart.grade = item.get("grade") if item.get("grade") != '' else NO_VALUE
-        sparepart.body = item.get("body") if item.get("body") != '' else NO_VALUE
-        sparepart.engine = item.get("engine") if item.get("engine") != '' else NO_VALUE
-        sparepart.transmission = item.get("transmission") if item.get("transmission") != '' else NO_VALUE
-        sparepart.destination = item.get("destination") if item.get("destination") != '' else NO_VALUE
-        sparepart.from_date = item.get("from_date") if item.get("from_date") != '' else NO_VALUE
-        sparepart.to_date = item.get("to_date") if item.get("to_date") != '' else NO_VALUE
-        sparepart.gear_shift_type = item.get("gear_shift_type") if item.get("gear_shift_type") != '' else NO_VALUE
-        sparepart.model = item.get("model") if item.get("model") != '' else NO_VALUE
-        sparepart.vehicle_model = item.get("vehicle_model") if item.get("vehicle_model") != '' else NO_VALUE
-        if item.get("vehicle_model", None):
-            sparepart.model = item.get("vehicle_model") if item.get("vehicle_model") != '' else NO_VALUE
-        elif item.get("model_code", None):
-            sparepart.model = item.get("model_code") if item.get("model_code") != '' else NO_VALUE
-
-        sparepart.model_mark = item.get("model_mark") if item.get("model_mark") != '' else NO_VALUE
-        sparepart.seating_capacity = item.get("seating_capacity") if item.get("seating_capacity") != '' else NO_VALUE
-        sparepart.fuel_induction = item.get("fuel_induction") if item.get("fuel_induction") != '' else NO_VALUE
-        sparepart.drive = item.get("drive") if item.get("drive") != '' else NO_VALUE
-        sparepart.door_number = item.get("door_number") if item.get("door_number") != '' else NO_VALUE
-        sparepart.note = item.get("note") if item.get("note") != '' else NO_VALUE
-        sparepart.assembly_group = item.get("assembly_group")
-        sparepart.assembly_set = item.get("assembly_set") if item.get("assembly_set") != '' else NO_VALUE
-
-        sparepart.reference = item.get("reference") if item.get("reference") != '' else NO_VALUE
-        sparepart.part_name = item.get("part_name") if item.get("part_name") != '' else NO_VALUE
-        sparepart.part_number = item.get("part_number") if item.get("part_number") != '' else NO_VALUE
-        sparepart.replacement_for = item.get("replacement_for") if item.get("replacement_for") != '' else NO_VALUE
-        sparepart.description = item.get("description") if item.get("description") != '' else NO_VALUE
-        sparepart.price = item.get("price") if item.get("price") != '' else NO_VALUE
-        sparepart.source_url = item.get("source_url") if item.get("source_url") != '' else NO_VALUE
-
         try:
-
-            # save images relation
-            try:
-                for img in item.get("images", None):
-                    img.update({'image_name': sparepart.assembly_set, 'merk': sparepart.merk,
-                                'model': sparepart.model if sparepart.model else sparepart.vehicle_model,
-                                'type': sparepart.frame,
-                                # 'force_create_new': True
-                                })
-                    image = save_image(session, ImageMegazip, img)
-                    spider.logger.debug('-------------- image type: {}'.format(type(image)))
-                    try:
-                        spider.logger.debug('-------------- image id: {}'.format(image.id))
-                    except Exception as e:
-                        spider.logger.warning("exception image_id.{} - {}".format(type(e), str(e)))
-
-                    sparepart.image_id = image.id
-
-            except Exception as e:
-                spider.logger.warning("{} - {}".format(type(e), str(e)))
-
-            session.add(sparepart)
+            sparepart = self.prepare(item, spider)
+            if image_ids is None:
+                image_ids = self.save_images(session, item.get("images") or [], sparepart, spider)
             session.commit()
+            self.write_row(sparepart, self.image_links(sparepart, image_ids))
+
         except IntegrityError as e:
             spider.logger.warning("IntegrityError Exception. {} - {}".format(type(e), str(e)))
+            self.writer.inc_stats('db_writer/failed_items')
             session.rollback()
+            self.image_cache.clear()
         except Exception as e:
             spider.logger.error("EXCEPTION... {} - {}".format(type(e), str(e)))
+            self.writer.inc_stats('db_writer/failed_items')
             session.rollback()
+            self.image_cache.clear()
             # raise
         finally:
             session.close()
 
         return item
 
+    def save_assembly_set(self, item, spider):
+        """Save the images of an assembly set once for all its parts, returns the image ids.
 
-class SparepartSuzukiPipeline(BasePipeline):
-
-    def process_item(self, item, spider):
-        """Save spareparts in the database.
-        This method is called for every item pipeline component.
+        This method runs on the writer thread pool.
         """
-
-        if os.environ.get('SAVE_AS_JSON'):
-            return item
+        sparepart = self.prepare(item['vehicle'], spider)
 
         session = self.Session()
-        sparepart = SparepartSuzuki(**{'job_id': spider._job})
-
-        sparepart.id = item.get("id") if item.get("id") != '' else NO_VALUE
-        sparepart.image_id = item.get("image_id") if item.get("image_id") != '' else NO_VALUE
-        sparepart.source_url = item.get("source_url") if item.get("source_url") != '' else NO_VALUE
-        sparepart.merk = item.get("merk") if item.get("merk") != '' else NO_VALUE
-        sparepart.model = item.get("model") if item.get("model") != '' else NO_VALUE
-        sparepart.group = item.get("group") if item.get("group") != '' else NO_VALUE
-        sparepart.assembly_set = item.get("assembly_set") if item.get("assembly_set") != '' else NO_VALUE
-
-        sparepart.part_name = item.get("part_name") if item.get("part_name") != '' else NO_VALUE
-        sparepart.part_number = item.get("part_number") if item.get("part_number") != '' else NO_VALUE
-        sparepart.substitution_part_number = item.get("substitution_part_number") if item.get("substitution_part_number") != '' else NO_VALUE
-        sparepart.qty = item.get("qty") if item.get("qty") != '' else NO_VALUE
-        sparepart.price = item.get("price") if item.get("price") != '' else NO_VALUE
-        sparepart.remarks = item.get("remarks") if item.get("remarks") != '' else NO_VALUE
-        sparepart.tag_no = item.get("tag_no") if item.get("tag_no") != '' else NO_VALUE
-
         try:
-
-            # save images relation
-            try:
-                for img in item.get("images", None):
-                    img.update({'image_name': sparepart.assembly_set, 'merk': sparepart.merk,
-                                'model': sparepart.model, 'id': sparepart.image_id, 'group': sparepart.group})
-                    image = save_image(session, ImageSuzuki, img)
-
-            except Exception as e:
-                spider.logger.warning("{} - {}".format(type(e), str(e)))
-
-            session.add(sparepart)
+            image_ids = self.save_images(session, item.get("images") or [], sparepart, spider)
             session.commit()
-
-        except IntegrityError as e:
-            spider.logger.warning("IntegrityError Exception. {} - {}".format(type(e), str(e)))
-            session.rollback()
+            return image_ids
         except Exception as e:
             spider.logger.error("EXCEPTION... {} - {}".format(type(e), str(e)))
+            self.writer.inc_stats('db_writer/failed_items')
             session.rollback()
-            # raise
+            self.image_cache.clear()
+            return []
         finally:
             session.close()
 
-        return item
-
-
-class SparepartDaihatsuPipeline(BasePipeline):
-
-    def process_item(self, item, spider):
-        """Save spareparts in the database.
-        This method is called for every item pipeline component.
+    def assembly_set_saved(self, image_ids, url):
+        if not isinstance(image_ids, list):  # failure, the parts are saved without images
+            image_ids = []
+        self.assembly_images[url] = image_ids
+        while len(self.assembly_images) > self.assembly_cache_size:
+            self.assembly_images.popitem(last=False)
+        self.release_waiters(url, image_ids)
+
+    def assembly_set_lost(self, item, spider, **kwargs):
+        """An assembly set dropped or failed in an earlier pipeline, its parts are saved without images"""
+        if isinstance(item, AssemblySetItem) and item.get('assembly_set_url'):
+            self.assembly_set_saved([], item['assembly_set_url'])
+
+    def release_waiters(self, url, image_ids):
+        for d, timeout in self.assembly_waiters.pop(url, []):
+            if timeout.active():
+                timeout.cancel()
+            d.callback(image_ids)
+
+    def assembly_set_images(self, url):
+        """
+        Return a Deferred firing with the image ids of an assembly set once they are saved, with no image ids
+        when the assembly set did not come within ASSEMBLY_WAIT_TIMEOUT seconds
         """
+        if url in self.assembly_images:
+            self.assembly_images.move_to_end(url)
+            return defer.succeed(self.assembly_images[url])
+        d = defer.Deferred()
+        timeout = reactor.callLater(self.assembly_wait_timeout, self.assembly_wait_expired, url, d)
+        self.assembly_waiters.setdefault(url, []).append((d, timeout))
+        return d
+
+    def assembly_wait_expired(self, url, d):
+        waiters = [waiter for waiter in self.assembly_waiters.pop(url, []) if waiter[0] is not d]
+        if waiters:
+            self.assembly_waiters[url] = waiters
+        logger.warning('no assembly set for {}, the part is saved without images'.format(url))
+        self.writer.inc_stats('assembly_set/wait_timeout')
+        d.callback([])
 
-        spider.logger.debug("Item type: {}".format(type(item)))
 
-        if os.environ.get('SAVE_AS_JSON') or not isinstance(item, DaihatsuItem):
-            return item
+class SparepartIsuzuPipeline(BasePipeline):
+    sparepart_cls = SparepartIsuzu
+    image_cls = ImageIsuzu
+
+    def build_sparepart(self, item, spider):
+        sparepart = {'job_id': spider._job}
+        sparepart['merk'] = item.get("merk")
+        sparepart['model_mobil'] = item.get("model_mobil")
+        sparepart['tipe_mobil'] = item.get("tipe_mobil")
+        sparepart['main_group'] = item.get("main_group")
+        sparepart['assembly_set'] = item.get("assembly_set")
+        sparepart['key'] = item.get("key")
+        sparepart['part_number'] = item.get("part_number")
+        sparepart['itc'] = item.get("itc")
+        sparepart['description'] = item.get("description")
+        sparepart['qty'] = item.get("qty")
+        sparepart['app_date'] = item.get("app_date")
+        sparepart['qty_value'] = parse_qty(item.get("qty"))
+        sparepart['app_date_value'] = parse_date(item.get("app_date"))
+        sparepart['lr'] = item.get("lr")
+        sparepart['model'] = item.get("model")
+        sparepart['remarks'] = item.get("remarks")
+        sparepart['source_url'] = item.get("source_url")
+        return sparepart
+
+    def image_info(self, sparepart):
+        return {'image_name': sparepart['assembly_set'], 'merk': sparepart['merk'],
+                'model': sparepart['model_mobil'], 'type': sparepart['tipe_mobil']}
+
+    def image_links(self, sparepart, image_ids):
+        # many-to-many: one link row per image, filled with the part id by the writer
+        return [(ImageLinkIsuzu, {'image_id': image_id}, 'part_id') for image_id in image_ids]
 
-        session = self.Session()
-        sparepart = SparepartDaihatsu(**{'job_id': spider._job})
 
-        sparepart.source_url = item.get("source_url") if item.get("source_url") != '' else NO_VALUE
-        sparepart.merk = item.get("merk") if item.get("merk") != '' else NO_VALUE
-        sparepart.model = item.get("model_mobil") if item.get("model_mobil") != '' else NO_VALUE
-        sparepart.group = item.get("group") if item.get("group") != '' else NO_VALUE
-        sparepart.assembly_set = item.get("assembly_set") if item.get("assembly_set") != '' else NO_VALUE
+class SparepartPartsPipeline(BasePipeline):
+    sparepart_cls = SparepartParts
+    image_cls = ImageParts
+
+    def build_sparepart(self, item, spider):
+        sparepart = {'job_id': spider._job}
+        sparepart['merk'] = item.get("merk")
+        sparepart['model_year'] = item.get("model_year")
+        sparepart['model_mobil'] = item.get("model_mobil")
+        sparepart['submodel'] = item.get("submodel")
+        sparepart['engine'] = item.get("engine")
+        sparepart['section'] = item.get("section")
+        sparepart['group'] = item.get("group")
+        sparepart['subgroup'] = item.get("subgroup")
+        sparepart['part_name'] = item.get("part_name")
+        sparepart['part_number'] = item.get("part_number")
+        sparepart['price'] = item.get("price")
+        sparepart['price_value'] = parse_price(item.get("price"))
+        sparepart['description'] = item.get("description")
+        sparepart['source_url'] = item.get("source_url")
+        sparepart['lookup_no'] = item.get("lookup_no")
+        sparepart['image_id'] = None
+        return sparepart
+
+    def image_info(self, sparepart):
+        return {'image_name': sparepart['subgroup'], 'merk': sparepart['merk'],
+                'model': sparepart['model_mobil'], 'type': sparepart['submodel']}
 
-        sparepart.prod_date = item.get("prod_date") if item.get("prod_date") != '' else NO_VALUE
-        sparepart.part_name = item.get("part_name") if item.get("part_name") != '' else NO_VALUE
-        sparepart.part_number = item.get("part_number") if item.get("part_number") != '' else NO_VALUE
-        sparepart.price = item.get("price") if item.get("price") != '' else NO_VALUE
 
-        try:
+class SparepartMegazipPipeline(BasePipeline):
+    sparepart_cls = SparepartMegazip
+    image_cls = ImageMegazip
+
+    def build_sparepart(self, item, spider):
+        sparepart = {'job_id': spider._job}
+
+        sparepart['merk'] = item.get("merk")
+        sparepart['varian'] = item.get("varian")
+        sparepart['model_year'] = item.get("model_year")
+        sparepart['frame'] = item.get("frame")
+        sparepart['grade'] = item.get("grade")
+        sparepart['body'] = item.get("body")
+        sparepart['engine'] = item.get("engine")
+        sparepart['transmission'] = item.get("transmission")
+        sparepart['destination'] = item.get("destination")
+        sparepart['from_date'] = item.get("from_date")
+        sparepart['to_date'] = item.get("to_date")
+        sparepart['from_date_value'] = parse_date(item.get("from_date"))
+        sparepart['to_date_value'] = parse_date(item.get("to_date"))
+        sparepart['gear_shift_type'] = item.get("gear_shift_type")
+        sparepart['model'] = item.get("model")
+        sparepart['vehicle_model'] = item.get("vehicle_model")
+        if item.get("vehicle_model", None):
+            sparepart['model'] = item.get("vehicle_model")
+        elif item.get("model_code", None):
+            sparepart['model'] = item.get("model_code")
+
+        sparepart['model_mark'] = item.get("model_mark")
+        sparepart['seating_capacity'] = item.get("seating_capacity")
+        sparepart['fuel_induction'] = item.get("fuel_induction")
+        sparepart['drive'] = item.get("drive")
+        sparepart['door_number'] = item.get("door_number")
+        sparepart['note'] = item.get("note")
+        sparepart['assembly_group'] = item.get("assembly_group")
+        sparepart['assembly_set'] = item.get("assembly_set")
+
+        sparepart['reference'] = item.get("reference")
+        sparepart['part_name'] = item.get("part_name")
+        sparepart['part_number'] = item.get("part_number")
+        sparepart['replacement_for'] = item.get("replacement_for")
+        sparepart['description'] = item.get("description")
+        sparepart['price'] = item.get("price")
+        sparepart['price_value'] = parse_price(item.get("price"))
+        sparepart['source_url'] = item.get("source_url")
+        sparepart['image_id'] = None
+        return sparepart
+
+    def image_info(self, sparepart):
+        return {'image_name': sparepart['assembly_set'], 'merk': sparepart['merk'],
+                'model': sparepart['model'] if sparepart['model'] else sparepart['vehicle_model'],
+                'type': sparepart['frame'],
+                # 'force_create_new': True
+                }
 
-            # save images relation
-            try:
-                for img in item.get("images", None):
-                    img.update({'image_name': sparepart.assembly_set, 'merk': sparepart.merk,
-                                'model': sparepart.model, 'group': sparepart.group})
-                    image = save_image(session, ImageDaihatsu, img)
-                    sparepart.image_id = image.id
 
-            except Exception as e:
-                spider.logger.warning("{} - {}".format(type(e), str(e)))
+class SparepartSuzukiPipeline(BasePipeline):
+    sparepart_cls = SparepartSuzuki
+    image_cls = ImageSuzuki
+
+    def build_sparepart(self, item, spider):
+        sparepart = {'job_id': spider._job}
+
+        sparepart['id'] = item.get("id")
+        sparepart['image_id'] = item.get("image_id")
+        sparepart['source_url'] = item.get("source_url")
+        sparepart['merk'] = item.get("merk")
+        sparepart['model'] = item.get("model")
+        sparepart['group'] = item.get("group")
+        sparepart['assembly_set'] = item.get("assembly_set")
+
+        sparepart['part_name'] = item.get("part_name")
+        sparepart['part_number'] = item.get("part_number")
+        sparepart['substitution_part_number'] = item.get("substitution_part_number")
+        sparepart['qty'] = item.get("qty")
+        sparepart['price'] = item.get("price")
+        sparepart['qty_value'] = parse_qty(item.get("qty"))
+        sparepart['price_value'] = parse_price(item.get("price"))
+        sparepart['remarks'] = item.get("remarks")
+        sparepart['tag_no'] = item.get("tag_no")
+        return sparepart
+
+    def image_info(self, sparepart):
+        # the figure id of the part is the id of the image
+        return {'image_name': sparepart['assembly_set'], 'merk': sparepart['merk'],
+                'model': sparepart['model'], 'id': sparepart['image_id'], 'group': sparepart['group']}
+
+    def image_links(self, sparepart, image_ids):
+        return None
 
-            session.add(sparepart)
-            session.commit()
 
-        except IntegrityError as e:
-            spider.logger.warning("IntegrityError Exception. {} - {}".format(type(e), str(e)))
-            session.rollback()
-        except Exception as e:
-            spider.logger.error("EXCEPTION... {} - {}".format(type(e), str(e)))
-            session.rollback()
-            # raise
-        finally:
-            session.close()
+class SparepartDaihatsuPipeline(BasePipeline):
 
-        return item
+    item_cls = DaihatsuItem
+    sparepart_cls = SparepartDaihatsu
+    image_cls = ImageDaihatsu
 
+    def build_sparepart(self, item, spider):
+        sparepart = {'job_id': spider._job}
 
-class DaihatsuPartSearchPipeline(BasePipeline):
+        sparepart['source_url'] = item.get("source_url")
+        sparepart['merk'] = item.get("merk")
+        sparepart['model'] = item.get("model_mobil")
+        sparepart['group'] = item.get("group")
+        sparepart['assembly_set'] = item.get("assembly_set")
 
-    def process_item(self, item, spider):
-        """Save spareparts in the database.
-        This method is called for every item pipeline component.
-        """
+        sparepart['prod_date'] = item.get("prod_date")
+        sparepart['prod_date_from'], sparepart['prod_date_to'] = parse_date_range(item.get("prod_date"))
+        sparepart['part_name'] = item.get("part_name")
+        sparepart['part_number'] = item.get("part_number")
+        sparepart['price'] = item.get("price")
+        sparepart['price_value'] = parse_price(item.get("price"))
+        sparepart['image_id'] = None
+        return sparepart
 
-        spider.logger.debug("Item type: {}".format(type(item)))
+    def image_info(self, sparepart):
+        return {'image_name': sparepart['assembly_set'], 'merk': sparepart['merk'],
+                'model': sparepart['model'], 'group': sparepart['group']}
 
-        if os.environ.get('SAVE_AS_JSON') or not isinstance(item, DaihatsuPartSearchItem):
-            return item
 
-        session = self.Session()
-        sparepart = SparepartDaihatsuPartSearch(**{'job_id': spider._job})
-
-        sparepart.source_url = item.get("source_url") if item.get("source_url") != '' else NO_VALUE
-        sparepart.merk = item.get("merk") if item.get("merk") != '' else NO_VALUE
-        sparepart.model = item.get("model_mobil") if item.get("model_mobil") != '' else NO_VALUE
-        sparepart.models = item.get("models") if item.get("models") != '' else NO_VALUE
-
-        sparepart.prod_date = item.get("prod_date") if item.get("prod_date") != '' else NO_VALUE
-        sparepart.part_name = item.get("part_name") if item.get("part_name") != '' else NO_VALUE
-        sparepart.part_number = item.get("part_number") if item.get("part_number") != '' else NO_VALUE
-        sparepart.spec_code = item.get("spec_code") if item.get("spec_code") != '' else NO_VALUE
-        sparepart.description = item.get("description") if item.get("description") != '' else NO_VALUE
-        sparepart.ref_no = item.get("ref_no") if item.get("ref_no") != '' else NO_VALUE
-        sparepart.qty = item.get("qty") if item.get("qty") != '' else NO_VALUE
-        sparepart.rev_ref_fr = item.get("rev_ref_fr") if item.get("rev_ref_fr") != '' else NO_VALUE
-        sparepart.rev_ref_to = item.get("rev_ref_to") if item.get("rev_ref_to") != '' else NO_VALUE
-        sparepart.weight = item.get("weight") if item.get("weight") != '' else NO_VALUE
-        sparepart.substitution = item.get("substitution") if item.get("substitution") != '' else NO_VALUE
+class DaihatsuPartSearchPipeline(BasePipeline):
 
+    item_cls = DaihatsuPartSearchItem
+    sparepart_cls = SparepartDaihatsuPartSearch
+
+    def build_sparepart(self, item, spider):
+        sparepart = {'job_id': spider._job}
+
+        sparepart['source_url'] = item.get("source_url")
+        sparepart['merk'] = item.get("merk")
+        sparepart['model'] = item.get("model_mobil")
+        sparepart['models'] = item.get("models")
+
+        sparepart['prod_date'] = item.get("prod_date")
+        sparepart['prod_date_from'], sparepart['prod_date_to'] = parse_date_range(item.get("prod_date"))
+        sparepart['part_name'] = item.get("part_name")
+        sparepart['part_number'] = item.get("part_number")
+        sparepart['spec_code'] = item.get("spec_code")
+        sparepart['description'] = item.get("description")
+        sparepart['ref_no'] = item.get("ref_no")
+        sparepart['qty'] = item.get("qty")
+        sparepart['qty_value'] = parse_qty(item.get("qty"))
+        sparepart['rev_ref_fr'] = item.get("rev_ref_fr")
+        sparepart['rev_ref_to'] = item.get("rev_ref_to")
+        sparepart['weight'] = item.get("weight")
+        sparepart['substitution'] = item.get("substitution")
+        return sparepart
+
+    def save_item(self, item, spider, image_ids=None):
+        """Save spareparts in the database, they have no images.
+        This method runs on the writer thread pool.
+        """
         try:
-            # save sparepart
-            session.add(sparepart)
-            session.commit()
-
-        except IntegrityError as e:
-            spider.logger.warning("IntegrityError Exception. {} - {}".format(type(e), str(e)))
-            session.rollback()
+            self.write_row(self.prepare(item, spider))
         except Exception as e:
             spider.logger.error("EXCEPTION... {} - {}".format(type(e), str(e)))
-            session.rollback()
-            # raise
-        finally:
-            session.close()
-
+            self.writer.inc_stats('db_writer/failed_items')
         return item
 
 
 class JsonPipeline(object):
+    """
+    Export the items to data/<spider>/<timestamp>_<job>.json and place their images in data/<spider>/images.
+
+    JSON_EXPORT_FORMAT: 'json' writes one JSON array, 'jsonl' streams JSON Lines (see JsonLinesSink),
+    optionally compressed and resumed with the job.
+
+    JSON_IMAGES_MODE: 'link' hard-links every image once (copy when IMAGES_STORE is on another
+    filesystem), 'copy' copies it once, 'manifest' places nothing and writes a manifest mapping
+    the image files to their path in IMAGES_STORE.
+
+    JSON_ARCHIVE: at the end of the job the export and its images are packed into data/<spider>/<name>.zip
+    (see write_job_archive), JSON_ARCHIVE_PRUNE then removes the files the archive replaces.
+    """
     file = None
+    sink = None
+    flush_loop = None
     image_dir = None
     exporter = None
 
@@ -461,54 +694,316 @@ class JsonPipeline(object):
         self.image_dir = '{}/images'.format(os.path.dirname(filename_path))
         os.makedirs(self.image_dir, exist_ok=True)
 
-        self.file = open(filename_path, 'wb')
-        self.exporter = JsonItemExporter(self.file, encoding='utf-8', ensure_ascii=False)
-        self.exporter.start_exporting()
+        self.images_mode = spider.settings.get('JSON_IMAGES_MODE', 'link')
+        self.manifest_path = "{}/data/{}/{}.manifest.json".format(path, spider.name, filename)
+        self.placed = {}  # image file name -> image (path in IMAGES_STORE, checksum, url)
+        self.archive_path = "{}/data/{}/{}.zip".format(path, spider.name, filename)
+        self.bytes_written = 0
+
+        if spider.settings.get('JSON_EXPORT_FORMAT', 'json') == 'jsonl':
+            # a job resumed from its JOBDIR appends to the file of its first run
+            jobdir = spider.settings.get('JOBDIR')
+            self.sink = JsonLinesSink(filename_path[:-len('.json')] + '.jsonl',
+                                      compression=spider.settings.get('JSON_EXPORT_COMPRESSION') or None,
+                                      fsync=spider.settings.getbool('JSON_EXPORT_FSYNC', True),
+                                      state_path=os.path.join(jobdir, 'json_export.state') if jobdir else None)
+            if self.sink.resumed:
+                spider.logger.log(spider.log_lvl, 'resuming export to {} after {} items'.format(self.sink.path,
+                                                                                                self.sink.items))
+            self.export_path = self.sink.path
+            self.exporter = self.sink
+            self.flush_items = spider.settings.getint('JSON_EXPORT_FLUSH_ITEMS', 100)
+            self.flush_loop = task.LoopingCall(self.sink.flush)
+            self.flush_loop.start(spider.settings.getfloat('JSON_EXPORT_FLUSH_INTERVAL', 5), now=False)
+        else:
+            self.export_path = filename_path
+            self.file = open(filename_path, 'wb')
+            self.exporter = JsonItemExporter(self.file, encoding='utf-8', ensure_ascii=False)
+            self.exporter.start_exporting()
 
     def close_spider(self, spider):
         if not os.environ.get('SAVE_AS_JSON'):
             return False
 
-        self.exporter.finish_exporting()
-        self.file.close()
+        if self.sink:
+            if self.flush_loop and self.flush_loop.running:
+                self.flush_loop.stop()
+            self.sink.close()
+            self.bytes_written += self.sink.bytes_written
+        else:
+            self.exporter.finish_exporting()
+            self.bytes_written += self.file.tell()
+            self.file.close()
+
+        if self.images_mode == 'manifest':
+            with open(self.manifest_path, 'w') as f:
+                json.dump({'images_store': IMAGES_STORE,
+                           'images': {name: img['path'] for name, img in self.placed.items()}}, f, indent=1)
+                self.bytes_written += f.tell()
+
+        spider.crawler.stats.set_value('json_export/bytes_written', self.bytes_written, spider=spider)
+        spider.logger.log(spider.log_lvl, '{} bytes written to {}'.format(self.bytes_written, self.export_path))
+
+        if spider.settings.getbool('JSON_ARCHIVE'):
+            # pack the job output off the reactor thread, the crawl waits for it before closing
+            d = threads.deferToThread(self.archive, spider.settings.getbool('JSON_ARCHIVE_PRUNE'))
+            d.addCallback(self.archived, spider)
+            d.addErrback(self.archive_failed, spider)
+            return d
+
+    def archive(self, prune):
+        files = [self.export_path]
+        if self.images_mode == 'manifest':
+            files.append(self.manifest_path)
+        size = write_job_archive(self.archive_path, files, self.placed, IMAGES_STORE)
+        if prune:
+            # the images directory is shared by the jobs of the spider, only this job's placed files go
+            for file_path in files:
+                os.remove(file_path)
+            if self.images_mode != 'manifest':
+                for name in self.placed:
+                    target = '{}/{}'.format(self.image_dir, name)
+                    if os.path.exists(target):
+                        os.remove(target)
+        return size
+
+    def archived(self, size, spider):
+        spider.crawler.stats.set_value('json_export/archive_bytes', size, spider=spider)
+        spider.logger.log(spider.log_lvl, '{} images archived to {} ({} bytes)'.format(len(self.placed),
+                                                                                    self.archive_path, size))
+
+    def archive_failed(self, failure, spider):
+        spider.logger.error('archiving {} failed. {} - {}'.format(self.archive_path, failure.type,
+                                                                str(failure.value)))
 
     def process_item(self, item, spider):
         if not os.environ.get('SAVE_AS_JSON'):
             return item
 
-        # copy images to respective spider directory
+        # place every image once in the spider directory
         if 'images' in item:
             for img in item.get("images", None):
-                img_path = '{}/{}'.format(IMAGES_STORE, img['path'])
-                copy2(img_path, '{}/{}'.format(self.image_dir, img_path.split('/')[-1]))
+                self.place_image(img, spider)
 
         # export item
         self.exporter.export_item(item)
+        if self.sink and self.sink.pending >= self.flush_items:
+            self.sink.flush()
+        return item
+
+    def place_image(self, img, spider):
+        img_path = '{}/{}'.format(IMAGES_STORE, img['path'])
+        name = img_path.split('/')[-1]
+        if name in self.placed:
+            return
+        self.placed[name] = {'path': img['path'], 'checksum': img.get('checksum'), 'url': img.get('url')}
+
+        stats = spider.crawler.stats
+        if self.images_mode == 'manifest':
+            stats.inc_value('json_export/images_referenced', spider=spider)
+            return
+
+        target = '{}/{}'.format(self.image_dir, name)
+        if os.path.exists(target):
+            os.remove(target)
+        if self.images_mode == 'link':
+            try:
+                os.link(img_path, target)
+                stats.inc_value('json_export/images_linked', spider=spider)
+                return
+            except OSError as e:
+                # e.g. IMAGES_STORE on another filesystem
+                spider.logger.debug('hard link failed for {}, copying. {}'.format(img_path, str(e)))
+        copy2(img_path, target)
+        self.bytes_written += os.path.getsize(target)
+        stats.inc_value('json_export/images_copied', spider=spider)
+
+
+class ParquetPipeline(object):
+    """
+    Export the items to data/<spider>/<timestamp>_<job>.<item class>.parquet when SAVE_AS_PARQUET is set,
+    one file and schema per item class, written in row groups of PARQUET_ROW_GROUP_SIZE items.
+    """
+    sinks = None
+
+    def open_spider(self, spider):
+        if not os.environ.get('SAVE_AS_PARQUET'):
+            return False
+        if pyarrow is None:
+            raise ValueError('SAVE_AS_PARQUET requires the pyarrow package')
+
+        if hasattr(spider, '_job'):
+            filename = '{}_{}'.format(datetime.datetime.now().strftime("%Y%m%d-%H%M%S"), spider._job)
+        else:
+            filename = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+
+        path = Path(os.path.dirname(__file__)).parent
+        self.filename_path = "{}/data/{}/{}".format(path, spider.name, filename)
+        os.makedirs(os.path.dirname(self.filename_path), exist_ok=True)
+        self.sinks = {}
+
+    def close_spider(self, spider):
+        if not os.environ.get('SAVE_AS_PARQUET'):
+            return False
+
+        for sink in self.sinks.values():
+            sink.close()
+            spider.crawler.stats.inc_value('parquet_export/items', sink.items, spider=spider)
+            spider.logger.log(spider.log_lvl, '{} items written to {}'.format(sink.items, sink.path))
+
+    def process_item(self, item, spider):
+        if not os.environ.get('SAVE_AS_PARQUET'):
+            return item
+
+        item_cls = type(item)
+        if item_cls not in self.sinks:
+            self.sinks[item_cls] = ParquetSink('{}.{}.parquet'.format(self.filename_path, item_cls.__name__), item_cls,
+                                               row_group_size=spider.settings.getint('PARQUET_ROW_GROUP_SIZE', 10000),
+                                               compression=spider.settings.get('PARQUET_COMPRESSION', 'snappy'))
+        self.sinks[item_cls].export_item(item)
         return item
 
 
-class MyImagesPipeline(ImagesPipeline):
+class MemoryImagesStore(FSFilesStore):
+    """
+    Keep downloaded images in IMAGE_BUFFER so the DB pipelines save them without a disk round-trip.
+    Thumbnails, which the DB pipelines do not save, and the oldest images when the buffer is full
+    go to the file system.
+    """
 
-    def convert_image(self, image, size=None):
-        # if image.format == 'PNG' and image.mode == 'RGBA':
-        #     pass
-        #     # background = Image.new('RGBA', image.size, (255, 255, 255))
-        #     # background.paste(image, image)
-        #     # image = background.convert('RGB')
-        # elif image.mode == 'P':
-        #     pass
-        #     image = image.convert("RGBA")
-        #     background = Image.new('RGBA', image.size, (255, 255, 255))
-        #     background.paste(image, image)
-        #     image = background.convert('RGB')
-        # elif image.mode != 'RGB':
-        #     image = image.convert('RGB')
+    def persist_file(self, path, buf, info, meta=None, headers=None):
+        if path.startswith('thumbs/'):
+            return super(MemoryImagesStore, self).persist_file(path, buf, info, meta, headers)
+        for spilled_path, data in IMAGE_BUFFER.put(path, buf.getvalue()):
+            super(MemoryImagesStore, self).persist_file(spilled_path, BytesIO(data), info, meta, headers)
+            IMAGE_BUFFER.discard(spilled_path, data)
 
-        if size:
-            image = image.copy()
-            image.thumbnail(size, Image.ANTIALIAS)
 
-        buf = BytesIO()
-        image.save(buf, image.format)
+class SparepartImagesPipeline(ImagesPipeline):
+    image_index = None
 
-        return image, buf
+    def open_spider(self, spider):
+        super(SparepartImagesPipeline, self).open_spider(spider)
+        # the JSON export places the downloaded files, an image of an earlier job may not exist anymore
+        if not os.environ.get('SAVE_AS_JSON'):
+            self.image_index = get_image_index()
+        self.index_max_age = spider.settings.getfloat('IMAGE_INDEX_MAX_AGE', 7)
+        if isinstance(self.store, MemoryImagesStore):
+            spider.crawler.signals.connect(self.release_images, signal=signals.item_dropped)
+            spider.crawler.signals.connect(self.release_images, signal=signals.item_error)
+
+    def release_images(self, item, **kwargs):
+        """Remove the buffered images of an item dropped or failed after this pipeline"""
+        for image in item.get(self.images_result_field) or []:
+            IMAGE_BUFFER.pop(image['path'])
+
+    def media_to_download(self, request, info):
+        entry = self.image_index.get(request.url) if self.image_index else None
+        # only images saved to the database by an earlier job can be skipped
+        if entry is None or entry['image_id'] is None:
+            return super(SparepartImagesPipeline, self).media_to_download(request, info)
+
+        age_days = (time.time() - entry['checked']) / 60 / 60 / 24
+        if age_days <= self.index_max_age:
+            self.inc_stats(info.spider, 'indexed')
+            return {'url': request.url, 'path': entry['path'], 'checksum': entry['checksum']}
+
+        # revalidate old entries with a conditional request
+        request.meta['image_index'] = entry
+        if entry['etag']:
+            request.headers['If-None-Match'] = entry['etag']
+        if entry['last_modified']:
+            request.headers['If-Modified-Since'] = entry['last_modified']
+
+    def media_downloaded(self, response, request, info):
+        entry = request.meta.get('image_index')
+        if entry and response.status == 304:
+            self.image_index.touch(request.url)
+            self.inc_stats(info.spider, 'not_modified')
+            return {'url': request.url, 'path': entry['path'], 'checksum': entry['checksum']}
+
+        result = super(SparepartImagesPipeline, self).media_downloaded(response, request, info)
+        # images converted in worker processes (MyImagesPipeline) get their checksum later
+        if isinstance(result['checksum'], defer.Deferred):
+            return result['checksum'].addCallback(
+                lambda checksum: self.index_downloaded(dict(result, checksum=checksum), response, request))
+        return self.index_downloaded(result, response, request)
+
+    def index_downloaded(self, result, response, request):
+        if self.image_index:
+            etag, last_modified = response.headers.get('ETag'), response.headers.get('Last-Modified')
+            self.image_index.put(request.url, result['checksum'], result['path'],
+                                 etag=etag.decode('latin-1') if etag else None,
+                                 last_modified=last_modified.decode('latin-1') if last_modified else None)
+        return result
+
+    def _get_store(self, uri):
+        # images are only handed over in memory when they go to the database
+        if IMAGES_STORE_MODE == 'memory' and not os.environ.get('SAVE_AS_JSON'):
+            return MemoryImagesStore(uri)
+        return super(SparepartImagesPipeline, self)._get_store(uri)
+
+
+def deferred_from_future(future):
+    """Wrap a concurrent.futures.Future in a Deferred fired in the reactor thread"""
+    dfd = defer.Deferred()
+
+    def done(future):
+        try:
+            result = future.result()
+        except Exception as e:
+            reactor.callFromThread(dfd.errback, e)
+        else:
+            reactor.callFromThread(dfd.callback, result)
+
+    future.add_done_callback(done)
+    return dfd
+
+
+class MyImagesPipeline(SparepartImagesPipeline):
+    """
+    Images pipeline keeping the original image format. Decoding, thumbnails and recompression
+    run in a process pool of IMAGES_TRANSCODE_PROCESSES workers (default: one per CPU).
+    """
+    executor = None
+
+    def open_spider(self, spider):
+        super(MyImagesPipeline, self).open_spider(spider)
+        self.recompress = spider.settings.getbool('IMAGES_RECOMPRESS', True)
+        self.executor = ProcessPoolExecutor(spider.settings.getint('IMAGES_TRANSCODE_PROCESSES', 0) or os.cpu_count())
+        # start the workers now, before the database writer threads are started
+        self.executor.submit(int)
+
+    def close_spider(self, spider):
+        if self.executor:
+            self.executor.shutdown(wait=False)
+
+    def image_downloaded(self, response, request, info):
+        """Convert the image in a worker process, returns a Deferred firing with the checksum"""
+        future = self.executor.submit(transcode_image, response.body, self.thumbs,
+                                      self.min_width, self.min_height, self.recompress)
+        dfd = deferred_from_future(future)
+        dfd.addCallback(self.persist_images, response, request, info)
+        dfd.addErrback(self.transcode_failed, request, info)
+        return dfd
+
+    def persist_images(self, results, response, request, info):
+        checksum = None
+        stats = info.spider.crawler.stats
+        content_type = response.headers.get('Content-Type', b'image/jpeg').decode('latin-1')
+        for thumb_id, width, height, data in results:
+            if thumb_id is None:
+                path = self.file_path(request, response=response, info=info)
+                checksum = md5sum(BytesIO(data))
+                stats.inc_value('image_bytes/original', len(response.body), spider=info.spider)
+                stats.inc_value('image_bytes/compressed', len(data), spider=info.spider)
+            else:
+                path = self.thumb_path(request, thumb_id, response=response, info=info)
+                stats.inc_value('image_bytes/thumbnails', len(data), spider=info.spider)
+            self.store.persist_file(path, BytesIO(data), info, meta={'width': width, 'height': height},
+                                    headers={'Content-Type': content_type})
+        return checksum
+
+    def transcode_failed(self, failure, request, info):
+        logger.warning('Image (error): Error converting image from {}. {}'.format(request, failure.value))
+        raise FileException(str(failure.value))
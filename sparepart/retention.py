@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+# retention of the part rows of past jobs and their removal in bounded batches
+import re
+import json
+import datetime
+from sqlalchemy import select, and_, or_, exists, func, text
+from .models import ScrapingJob, LatestScope, ImageLinkIsuzu, SparepartIsuzu, SparepartParts, SparepartMegazip, \
+    SparepartSuzuki, SparepartDaihatsu, SparepartDaihatsuPartSearch
+from .latest import job_scope
+
+SPIDER_TABLES = {
+    'isuzu': (SparepartIsuzu,),
+    'parts.com': (SparepartParts,),
+    'megazip': (SparepartMegazip,),
+    'suzuki': (SparepartSuzuki,),
+    'daihatsu': (SparepartDaihatsu, SparepartDaihatsuPartSearch),
+}
+
+# rows referencing the part rows, deleted first: (model, column holding the part id)
+CHILD_TABLES = {SparepartIsuzu: ((ImageLinkIsuzu, 'part_id'),)}
+
+
+def retention_policy(settings, spider):
+    """{'jobs': n, 'days': n} of a spider, 0 meaning no limit"""
+    policy = {'jobs': settings.getint('RETENTION_JOBS', 0), 'days': settings.getint('RETENTION_DAYS', 0)}
+    policy.update(json.loads(settings.get('RETENTION_POLICY') or '{}').get(spider, {}))
+    return policy
+
+
+def expired_jobs(session, spider, policy, now=None):
+    """
+    Finished jobs of a spider whose rows the policy does not keep. Per merk/model the newest successful job,
+    the last `jobs` successful jobs and the jobs of the last `days` days are kept, and so is a job
+    published in a latest table.
+    """
+    if not policy.get('jobs') and not policy.get('days'):
+        return []
+    now = now or datetime.datetime.now()
+    published = {job_id for job_id, in session.query(LatestScope.job_id)}
+    jobs = session.query(ScrapingJob.id, ScrapingJob.input_param, ScrapingJob.reason, ScrapingJob.start).\
+        filter(ScrapingJob.spider == spider, ScrapingJob.status == 'finished').\
+        order_by(ScrapingJob.start.desc())
+
+    by_scope = {}
+    for job_id, input_param, reason, start in jobs:
+        try:
+            params = json.loads(input_param or '{}')
+        except ValueError:
+            continue
+        by_scope.setdefault(job_scope(params.get('merk'), params.get('model')), []).append((job_id, reason, start))
+
+    expired = []
+    for scope_jobs in by_scope.values():
+        successful = [job_id for job_id, reason, start in scope_jobs if reason == 'finished']
+        kept = set(successful[:max(policy.get('jobs') or (1 if policy.get('days') else len(successful)), 1)])
+        for job_id, reason, start in scope_jobs:
+            recent = policy.get('days') and start and now - start < datetime.timedelta(days=policy['days'])
+            if job_id in kept or job_id in published or recent:
+                continue
+            expired.append(job_id)
+    return expired
+
+
+def partitioned(conn, table):
+    """Whether a table is partitioned by the database (Oracle only)"""
+    if conn.dialect.name != 'oracle':
+        return False
+    query = text('SELECT COUNT(*) FROM user_part_tables WHERE table_name = :name')
+    return bool(conn.execute(query, name=table.name.upper()).scalar())
+
+
+def deletable(table, job_id, keep_live=False):
+    """
+    Condition on the rows of a job to delete: all of them, or with `keep_live` (the merge write mode, one row per
+    row_key updated in place) all but the live rows, the newest copy of their row_key. Rows without a row_key
+    (written before the row hashes) are always deleted.
+    """
+    if not keep_live:
+        return table.c.job_id == job_id
+    newer = table.alias()
+    return and_(table.c.job_id == job_id,
+                or_(table.c.row_key.is_(None),
+                    exists().where(and_(newer.c.row_key == table.c.row_key, newer.c.id > table.c.id))))
+
+
+def job_row_count(engine, sparepart_cls, job_id):
+    """Number of part rows of a job left in a part table"""
+    table = sparepart_cls.__table__
+    with engine.connect() as conn:
+        return conn.execute(select([func.count()]).select_from(table).where(table.c.job_id == job_id)).scalar()
+
+
+def delete_job_rows(engine, sparepart_cls, job_id, batch_size=1000, keep_live=False):
+    """
+    Delete the rows of a job (see `deletable`) from a part table and its child tables, `batch_size` part rows
+    per transaction, or by dropping the partition of the job when the table is partitioned and no row of
+    the job is kept. Returns the number of part rows deleted (None for a dropped partition).
+    """
+    table = sparepart_cls.__table__
+    children = [(cls.__table__, fk) for cls, fk in CHILD_TABLES.get(sparepart_cls, ())]
+    with engine.connect() as conn:
+        kept = keep_live and conn.execute(select([func.count()]).select_from(table).
+                                          where(and_(table.c.job_id == job_id,
+                                                     ~deletable(table, job_id, keep_live)))).scalar()
+        if not kept and partitioned(conn, table):
+            with conn.begin():
+                for child_table, fk in children:
+                    ids = select([table.c.id]).where(table.c.job_id == job_id)
+                    conn.execute(child_table.delete().where(child_table.c[fk].in_(ids)))
+                # DDL takes no bind parameters, scrapyd job ids are hexadecimal
+                if not re.match(r'^[\w-]+$', job_id):
+                    raise ValueError('invalid job id {}'.format(job_id))
+                conn.execute(text("ALTER TABLE {} DROP PARTITION FOR ('{}') UPDATE INDEXES".format(table.name, job_id)))
+            return None
+
+    deleted = 0
+    while True:
+        with engine.begin() as conn:
+            ids = [part_id for part_id, in conn.execute(select([table.c.id]).
+                                                        where(deletable(table, job_id, keep_live)).limit(batch_size))]
+            if not ids:
+                return deleted
+            for child_table, fk in children:
+                conn.execute(child_table.delete().where(child_table.c[fk].in_(ids)))
+            deleted += conn.execute(table.delete().where(and_(table.c.job_id == job_id,
+                                                              table.c.id.in_(ids)))).rowcount
@@ -117,3 +117,123 @@ else:
 
 if LOG_LEVEL == 'DEBUG':
     CLOSESPIDER_ITEMCOUNT = 10
+
+# batched inserts for the database pipelines: rows are written with one executemany
+# per table when DB_BATCH_SIZE rows are buffered or after DB_BATCH_INTERVAL seconds
+DB_BATCH_SIZE = int(os.environ.get('DB_BATCH_SIZE', 500))
+DB_BATCH_INTERVAL = float(os.environ.get('DB_BATCH_INTERVAL', 10))
+
+# shared SQLAlchemy engine (one connection pool per process)
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', '1') == '1'
+DB_ECHO = os.environ.get('DB_ECHO', '0') == '1'
+
+# database writes run on a dedicated thread pool. Items wait for a free slot once
+# DB_WRITER_MAX_PENDING writes are queued, which slows the downloader down.
+# keep one thread unless images may be inserted concurrently (get_or_create_id is not atomic)
+DB_WRITER_THREADS = int(os.environ.get('DB_WRITER_THREADS', 1))
+DB_WRITER_MAX_PENDING = int(os.environ.get('DB_WRITER_MAX_PENDING', 100))
+
+# number of image ids kept in the process-local image cache of every DB pipeline
+IMAGE_CACHE_SIZE = int(os.environ.get('IMAGE_CACHE_SIZE', 10000))
+
+# parts of an assembly set page wait for the images of the assembly set: the image ids of the last
+# ASSEMBLY_IMAGES_CACHE_SIZE assembly sets are kept, a part waits at most ASSEMBLY_WAIT_TIMEOUT seconds
+ASSEMBLY_IMAGES_CACHE_SIZE = int(os.environ.get('ASSEMBLY_IMAGES_CACHE_SIZE', 1000))
+ASSEMBLY_WAIT_TIMEOUT = float(os.environ.get('ASSEMBLY_WAIT_TIMEOUT', 600))
+
+# normalized schema: vehicle, assembly set and source url values of the part rows are stored once in
+# dimension tables and referenced by id, DB_DIMENSION_CACHE_SIZE ids are cached per pipeline
+DB_NORMALIZED = os.environ.get('DB_NORMALIZED', '0') == '1'
+DB_DIMENSION_CACHE_SIZE = int(os.environ.get('DB_DIMENSION_CACHE_SIZE', 100000))
+
+# 'insert' writes every part row of every job, 'merge' upserts the part rows on their natural key and skips
+# unchanged rows. DB_MERGE_KEYS overrides the natural keys, as JSON: {"<table>": ["column", ...]}.
+# The keys already in a table are kept in a Bloom filter sized for DB_MERGE_BLOOM_CAPACITY keys
+DB_WRITE_MODE = os.environ.get('DB_WRITE_MODE', 'insert')
+DB_MERGE_KEYS = os.environ.get('DB_MERGE_KEYS', '')
+DB_MERGE_BLOOM_CAPACITY = int(os.environ.get('DB_MERGE_BLOOM_CAPACITY', 1000000))
+DB_MERGE_BLOOM_ERROR_RATE = float(os.environ.get('DB_MERGE_BLOOM_ERROR_RATE', 0.01))
+
+# record a version of a part row in scraping_part_history when its content hash changed since the last job
+DB_HISTORY = os.environ.get('DB_HISTORY', '0') == '1'
+
+# also write the part rows to scraping_latest_<brand>, where they replace the rows of the previous job
+# of the same merk and model once the job finished
+DB_LATEST = os.environ.get('DB_LATEST', '0') == '1'
+
+# keep the supersessions of the part rows (megazip, suzuki, daihatsu part search) as a graph of normalized part
+# numbers in scraping_part_interchange, answering latest replacement / all equivalents queries (interchange.py)
+DB_INTERCHANGE = os.environ.get('DB_INTERCHANGE', '0') == '1'
+
+# keep "where used" postings of the part keys in scraping_part_usage: the vehicles and assembly sets of every
+# part table (whereused.py). Postings already written by the crawler process are not written again, up to
+# DB_WHERE_USED_CACHE_SIZE of them. Resolves the vehicle / assembly set dimension ids of every part row, also
+# without DB_NORMALIZED
+DB_WHERE_USED = os.environ.get('DB_WHERE_USED', '0') == '1'
+DB_WHERE_USED_CACHE_SIZE = int(os.environ.get('DB_WHERE_USED_CACHE_SIZE', 1000000))
+
+# retention of the part rows per spider and merk/model, applied by compact_jobs.py: keep the last RETENTION_JOBS
+# successful jobs and the jobs of the last RETENTION_DAYS days (0 = no limit). RETENTION_POLICY overrides them
+# per spider, as JSON: {"megazip": {"jobs": 2, "days": 0}}. Rows are deleted COMPACTION_BATCH_SIZE at a time.
+# All the rows of an expired job are deleted, except in merge mode (DB_WRITE_MODE) the live row of each row_key
+RETENTION_JOBS = int(os.environ.get('RETENTION_JOBS', 0))
+RETENTION_DAYS = int(os.environ.get('RETENTION_DAYS', 0))
+RETENTION_POLICY = os.environ.get('RETENTION_POLICY', '')
+COMPACTION_BATCH_SIZE = int(os.environ.get('COMPACTION_BATCH_SIZE', 1000))
+
+# Oracle: create the part tables list-partitioned by job_id, so compaction drops a job with its partition
+DB_PARTITION_BY_JOB = os.environ.get('DB_PARTITION_BY_JOB', '0') == '1'
+
+# the part rows are cleaned before they are written: whitespace collapsed, empty values replaced by '-',
+# values cut to the column length and, with DB_ASCII_ONLY, non-ASCII characters removed
+DB_ASCII_ONLY = os.environ.get('DB_ASCII_ONLY', '1') == '1'
+# with DB_ASCII_ONLY, replace the non-ASCII characters having an ASCII equivalent ('\u00b0' -> 'deg') instead
+DB_ASCII_TRANSLITERATE = os.environ.get('DB_ASCII_TRANSLITERATE', '0') == '1'
+
+# 'disk' keeps downloaded images under IMAGES_STORE until they are saved to the database,
+# 'memory' hands the bytes straight to the DB pipelines (up to IMAGES_MEMORY_MAX_BYTES, the oldest images then go
+# to disk). Thumbnails always go to disk
+IMAGES_STORE_MODE = os.environ.get('IMAGES_STORE_MODE', 'disk')
+IMAGES_MEMORY_MAX_BYTES = int(os.environ.get('IMAGES_MEMORY_MAX_BYTES', 256 * 1024 * 1024))
+
+# 'blob' stores image data in the image tables, 'files' stores every image once in a
+# content-addressed directory tree under IMAGE_FILES_STORE and keeps only its path in the database
+IMAGE_BACKEND = os.environ.get('IMAGE_BACKEND', 'blob')
+IMAGE_FILES_STORE = os.environ.get('IMAGE_FILES_STORE', '{}/data/image_store'.format(os.path.dirname(PROJECT_DIR)))
+IMAGE_FILES_CACHE_BYTES = int(os.environ.get('IMAGE_FILES_CACHE_BYTES', 64 * 1024 * 1024))
+
+# image URL index shared by all spiders: images stored by an earlier job are not downloaded again,
+# entries older than IMAGE_INDEX_MAX_AGE days are revalidated with a conditional request
+IMAGE_INDEX_PATH = os.environ.get('IMAGE_INDEX_PATH', '{}/dbs/image_index.db'.format(os.path.dirname(PROJECT_DIR)))
+IMAGE_INDEX_MAX_AGE = float(os.environ.get('IMAGE_INDEX_MAX_AGE', 7))
+
+# MyImagesPipeline converts images in a process pool (0 = one process per CPU) and recompresses them losslessly
+IMAGES_TRANSCODE_PROCESSES = int(os.environ.get('IMAGES_TRANSCODE_PROCESSES', 0))
+IMAGES_RECOMPRESS = os.environ.get('IMAGES_RECOMPRESS', '1') == '1'
+
+# map near-duplicate images (perceptual hash within IMAGE_DEDUPE_DISTANCE bits) to one stored image
+IMAGE_DEDUPE = os.environ.get('IMAGE_DEDUPE', '0') == '1'
+IMAGE_DEDUPE_DISTANCE = int(os.environ.get('IMAGE_DEDUPE_DISTANCE', 4))
+
+# images of the JSON export (SAVE_AS_JSON): 'link' hard-links them into data/<spider>/images,
+# 'copy' copies them, 'manifest' only lists their path in IMAGES_STORE
+JSON_IMAGES_MODE = os.environ.get('JSON_IMAGES_MODE', 'link')
+
+# JSON export (SAVE_AS_JSON): 'json' writes one JSON array at the end of the job, 'jsonl' appends
+# JSON Lines every JSON_EXPORT_FLUSH_ITEMS items or JSON_EXPORT_FLUSH_INTERVAL seconds and resumes with JOBDIR
+JSON_EXPORT_FORMAT = os.environ.get('JSON_EXPORT_FORMAT', 'json')
+JSON_EXPORT_COMPRESSION = os.environ.get('JSON_EXPORT_COMPRESSION', '')  # '', 'gzip' or 'zstd'
+JSON_EXPORT_FLUSH_ITEMS = int(os.environ.get('JSON_EXPORT_FLUSH_ITEMS', 100))
+JSON_EXPORT_FLUSH_INTERVAL = float(os.environ.get('JSON_EXPORT_FLUSH_INTERVAL', 5))
+JSON_EXPORT_FSYNC = os.environ.get('JSON_EXPORT_FSYNC', '1') == '1'
+
+# pack the JSON export and its images into one zip archive with a checksum index at the end of the job,
+# JSON_ARCHIVE_PRUNE removes the export and the images placed by the job once archived
+JSON_ARCHIVE = os.environ.get('JSON_ARCHIVE', '0') == '1'
+JSON_ARCHIVE_PRUNE = os.environ.get('JSON_ARCHIVE_PRUNE', '0') == '1'
+
+# Parquet export (SAVE_AS_PARQUET): one file per item class, written in row groups of PARQUET_ROW_GROUP_SIZE items
+PARQUET_ROW_GROUP_SIZE = int(os.environ.get('PARQUET_ROW_GROUP_SIZE', 10000))
+PARQUET_COMPRESSION = os.environ.get('PARQUET_COMPRESSION', 'snappy')
@@ -8,7 +8,7 @@ from twisted.internet.error import TimeoutError, TCPTimedOutError
 from requests.exceptions import ReadTimeout
 from scrapy.spiders import CrawlSpider
 from sqlalchemy.orm import sessionmaker, scoped_session
-from ..models import db_connect, ScrapingJob
+from ..models import db_connect, export_pool_stats, ScrapingJob
 from scrapy.utils.project import get_project_settings
 from ..helpers import read_file
 
@@ -54,7 +54,11 @@ class BaseSpider(CrawlSpider):
 
 
     def closed(self, reason):
+        export_pool_stats(self.crawler.stats, self)
         self.logger.log(self.log_lvl, 'statistics : {}'.format(str(self.crawler.stats._stats)))
+        backoff = self.crawler.stats.get_value('retry_429/backoff_seconds')
+        if backoff:
+            self.logger.log(self.log_lvl, 'backed off {} seconds in total because of status 429'.format(backoff))
 
         if hasattr(self, '_job') and os.environ.get('CONNECTION_STRING'):
             engine = db_connect()
@@ -4,7 +4,7 @@ import urllib.parse as urlparse
 from scrapy.spiders import Request
 from scrapy.http import FormRequest
 from .base import BaseSpider
-from ..items import DaihatsuItem, DaihatsuPartSearchItem
+from ..items import AssemblySetItem, DaihatsuItem, DaihatsuPartSearchItem
 from ..helpers import remove_non_ascii
 
 
@@ -15,8 +15,9 @@ class DaihatsuSpider(BaseSpider):
     custom_settings = {
         'DOWNLOAD_DELAY': 1,
         'ITEM_PIPELINES': {
-            'scrapy.pipelines.images.ImagesPipeline': 1,
+            'sparepart.pipelines.SparepartImagesPipeline': 1,
             'sparepart.pipelines.JsonPipeline': 100,
+            'sparepart.pipelines.ParquetPipeline': 101,
             'sparepart.pipelines.SparepartDaihatsuPipeline': 200,
             'sparepart.pipelines.DaihatsuPartSearchPipeline': 201,
         }
@@ -103,9 +104,10 @@ class DaihatsuSpider(BaseSpider):
         self.logger.log(self.log_lvl, 'scraping data @ {}'.format(response.url))
 
         image = response.css('.titlePage ~ .wrapper img::attr(src)').extract()
+        image_urls = [urlparse.urljoin(response.url, src) for src in image]
         vehicle = {'model_mobil': response.meta.get('model', None), 'group': response.meta.get('group_name', None),
                    'assembly_set': response.meta.get('assembly_set', None), 'merk': 'daihatsu',
-                   'source_url': response.url, 'image_urls': [urlparse.urljoin(response.url, src) for src in image]}
+                   'source_url': response.url, 'assembly_set_url': response.url}
 
         # Parse Sparepart Detail
         items = list()
@@ -120,6 +122,10 @@ class DaihatsuSpider(BaseSpider):
 
             items.append(item)
 
+        # the illustrations are stored once for all spareparts of the page
+        if items:
+            items.insert(0, AssemblySetItem(assembly_set_url=response.url, vehicle=vehicle, image_urls=image_urls))
+
         return items
 
     def parse_part_search(self, response):
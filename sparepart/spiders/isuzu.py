@@ -3,7 +3,7 @@ import re
 import json
 import urllib.parse as urlparse
 from scrapy.spiders import CrawlSpider, Request
-from ..items import IsuzuSparepartItem
+from ..items import AssemblySetItem, IsuzuSparepartItem
 from .base import BaseSpider
 
 
@@ -14,8 +14,9 @@ class IsuzuSpider(BaseSpider):
     custom_settings = {
         'DOWNLOAD_DELAY': 1,
         'ITEM_PIPELINES': {
-            'scrapy.pipelines.images.ImagesPipeline': 1,
+            'sparepart.pipelines.SparepartImagesPipeline': 1,
             'sparepart.pipelines.JsonPipeline': 100,
+            'sparepart.pipelines.ParquetPipeline': 101,
             'sparepart.pipelines.SparepartIsuzuPipeline': 200,
         }
     }
@@ -88,8 +89,8 @@ class IsuzuSpider(BaseSpider):
             item['tipe_mobil'] = tipe_mobil
             item['model_mobil'] = model_mobil
 
-            # images
-            item['image_urls'] = image_urls
+            # images, carried by the assembly set item of the page
+            item['assembly_set_url'] = response.url
 
             # grouping/assembly
             item['main_group'] = main_group
@@ -107,4 +108,10 @@ class IsuzuSpider(BaseSpider):
 
             item_list.append(item)
 
+        # the illustrations are stored once for all spareparts of the page
+        if item_list:
+            vehicle = {'source_url': response.url, 'merk': self.name, 'tipe_mobil': tipe_mobil,
+                       'model_mobil': model_mobil, 'main_group': main_group, 'assembly_set': assembly_set}
+            item_list.insert(0, AssemblySetItem(assembly_set_url=response.url, vehicle=vehicle, image_urls=image_urls))
+
         return item_list
@@ -6,7 +6,7 @@ import requests
 import urllib.parse as urlparse
 from requests.exceptions import ReadTimeout
 from scrapy.spiders import Request
-from ..items import MegazipItem
+from ..items import AssemblySetItem, MegazipItem
 from .base import BaseSpider
 from ..helpers import remove_non_ascii
 
@@ -22,6 +22,7 @@ class MegazipSpider(BaseSpider):
             # 'scrapy.pipelines.images.ImagesPipeline': 1,
             'sparepart.pipelines.MyImagesPipeline': 1,
             'sparepart.pipelines.JsonPipeline': 100,
+            'sparepart.pipelines.ParquetPipeline': 101,
             'sparepart.pipelines.SparepartMegazipPipeline': 200,
         },
         'DOWNLOADER_MIDDLEWARES': {
@@ -297,9 +298,10 @@ class MegazipSpider(BaseSpider):
         vehicle['engine'] = getattr(self, 'mesin', None)
         vehicle['assembly_group'] = response.meta.get('assembly_group', '-')
         vehicle['assembly_set'] = response.css('.breadcrumbs li:last-child::text').extract_first()
-        vehicle['image_urls'] = response.css('img#items_list_image::attr(src)').extract()
-        for k, v in enumerate(vehicle['image_urls']):
-            vehicle['image_urls'][k] = urlparse.urljoin(response.url, v)
+        vehicle['assembly_set_url'] = response.url
+        image_urls = response.css('img#items_list_image::attr(src)').extract()
+        for k, v in enumerate(image_urls):
+            image_urls[k] = urlparse.urljoin(response.url, v)
 
         vehicle['model_year'] = response.css('.s-catalog__header .s-catalog__attrs_type_dotted .s-catalog__attrs-data::text')\
             .extract_first()
@@ -379,4 +381,9 @@ class MegazipSpider(BaseSpider):
         if empty_count > 0:
             self.logger.log(self.log_lvl, 'There are {} empty data-items found in the page'.format(empty_count))
 
+        # the illustrations are stored once for all spareparts of the page
+        if item_list:
+            item_list.insert(0, AssemblySetItem(assembly_set_url=response.url, vehicle=dict(vehicle, source_url=response.url),
+                                                image_urls=image_urls))
+
         return item_list
@@ -16,8 +16,9 @@ class PartsSpider(BaseSpider):
         'DOWNLOAD_DELAY': 5,
         'AUTOTHROTTLE_START_DELAY': 5,
         'ITEM_PIPELINES': {
-            'scrapy.pipelines.images.ImagesPipeline': 1,
+            'sparepart.pipelines.SparepartImagesPipeline': 1,
             'sparepart.pipelines.JsonPipeline': 100,
+            'sparepart.pipelines.ParquetPipeline': 101,
             'sparepart.pipelines.SparepartPartsPipeline': 200,
         },
         'DOWNLOADER_MIDDLEWARES': {
@@ -2,7 +2,7 @@
 import json
 import re
 from scrapy.spiders import Request
-from ..items import SuzukiItem
+from ..items import AssemblySetItem, SuzukiItem
 from .base import BaseSpider
 from ..helpers import remove_non_ascii
 
@@ -15,8 +15,9 @@ class SuzukiSpider(BaseSpider):
     custom_settings = {
         'DOWNLOAD_DELAY': 1,
         'ITEM_PIPELINES': {
-            'scrapy.pipelines.images.ImagesPipeline': 1,
+            'sparepart.pipelines.SparepartImagesPipeline': 1,
             'sparepart.pipelines.JsonPipeline': 100,
+            'sparepart.pipelines.ParquetPipeline': 101,
             'sparepart.pipelines.SparepartSuzukiPipeline': 200,
         }
     }
@@ -107,15 +108,13 @@ class SuzukiSpider(BaseSpider):
         # section/grouping/assembly
         vehicle['group'] = response.meta.get('group', None)
         vehicle['assembly_set'] = response.meta.get('assembly_set', None)
+        vehicle['assembly_set_url'] = response.url
 
         parts = json.loads(response.body)
         item_list = []
         for itm in parts:
             item = SuzukiItem(**vehicle)
 
-            # illustration image
-            item['image_urls'] = [response.meta.get('image_url', None)]
-
             # sparepart details
             item['id'] = itm.get('id', None)
             item['image_id'] = itm.get('figure_id', None)
@@ -130,4 +129,10 @@ class SuzukiSpider(BaseSpider):
 
             item_list.append(item)
 
+        # the illustration is stored once for all parts, the figure id of the parts is the image id
+        if item_list:
+            item_list.insert(0, AssemblySetItem(assembly_set_url=response.url,
+                                                vehicle=dict(vehicle, image_id=item_list[0]['image_id']),
+                                                image_urls=[response.meta.get('image_url', None)]))
+
         return item_list
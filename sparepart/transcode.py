@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+# image conversion, run in the worker processes of MyImagesPipeline
+from io import BytesIO
+from PIL import Image
+from scrapy.pipelines.images import ImageException
+
+
+def transcode_image(body, thumbs=None, min_width=0, min_height=0, recompress=True):
+    """
+    Decode a downloaded image, create its thumbnails and encode everything again in the original format.
+
+    Returns a list of (thumb_id, width, height, data), thumb_id is None for the full image.
+    """
+    image = Image.open(BytesIO(body))
+    image_format = image.format
+    width, height = image.size
+    if width < min_width or height < min_height:
+        raise ImageException("Image too small (%dx%d < %dx%d)" % (width, height, min_width, min_height))
+
+    results = [(None, width, height, encode_image(image, image_format, recompress, original=body))]
+    for thumb_id, size in (thumbs or {}).items():
+        thumb = image.copy()
+        thumb.thumbnail(size, Image.ANTIALIAS)
+        results.append((thumb_id, thumb.size[0], thumb.size[1], encode_image(thumb, image_format, recompress)))
+    return results
+
+
+def encode_image(image, image_format, recompress=True, original=None):
+    options = {}
+    if recompress:
+        # optimized PNG/GIF compression is lossless; a JPEG is decoded and encoded again with its own quantization
+        # tables and subsampling and optimized huffman tables, which may round off some detail
+        options['optimize'] = True
+        if image_format == 'JPEG' and original is not None:
+            options['quality'] = 'keep'
+
+    buf = BytesIO()
+    image.save(buf, image_format, **options)
+    data = buf.getvalue()
+
+    # keep the downloaded bytes when encoding them again does not make them smaller
+    if recompress and original is not None and len(original) <= len(data):
+        return original
+    return data
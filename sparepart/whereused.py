@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+# "where used" postings: the vehicles and assembly sets using a part, by normalized part number
+import datetime
+import threading
+from collections import OrderedDict
+from sqlalchemy import select, and_, bindparam
+from .models import PartUsage, AssemblySet, SparepartIsuzu, SparepartParts, SparepartMegazip, SparepartSuzuki, \
+    SparepartDaihatsu, SparepartDaihatsuPartSearch
+from .dimensions import dimension_columns
+from .helpers import part_key
+
+PART_TABLES = {cls.__tablename__: cls for cls in (SparepartIsuzu, SparepartParts, SparepartMegazip, SparepartSuzuki,
+                                                  SparepartDaihatsu, SparepartDaihatsuPartSearch)}
+
+
+class WhereUsed(object):
+    """
+    Maintain the postings of the part rows of `sparepart_cls` in PartUsage (DB_WHERE_USED), in the transaction
+    of every batch of the writer: a posting is inserted the first time its part key, vehicle and assembly set
+    are seen and has its last job updated afterwards. The postings written by this process are remembered,
+    up to `max_size` of them, so a part listed on many pages costs one lookup per job.
+    Part tables without assembly columns (daihatsu part search) are posted by vehicle, with assembly id 0.
+    """
+
+    def __init__(self, sparepart_cls, stats=None, spider=None, max_size=1000000):
+        self.table = sparepart_cls.__table__
+        self.by_vehicle = not sparepart_cls.assembly_columns
+        self.stats = stats
+        self.spider = spider
+        self.max_size = max_size
+        self.written = OrderedDict()
+        self.lock = threading.Lock()
+
+    def record(self, conn, units, chunk_size=500):
+        postings = {}
+        for table, row, _ in units:
+            if table is not self.table or not row.get('part_key') or not row.get('vehicle_id'):
+                continue
+            assembly_id = 0 if self.by_vehicle else row.get('assembly_id')
+            if assembly_id is not None:
+                postings[(row['part_key'], row['vehicle_id'], assembly_id)] = row.get('job_id')
+        with self.lock:
+            postings = {posting: job_id for posting, job_id in postings.items() if posting not in self.written}
+        if not postings:
+            return
+
+        usage = PartUsage.__table__
+        part_keys = list({posting[0] for posting in postings})
+        existing = set()
+        for start in range(0, len(part_keys), chunk_size):
+            query = select([usage.c.part_key, usage.c.vehicle_id, usage.c.assembly_id]).\
+                where(and_(usage.c.table_name == self.table.name, usage.c.part_key.in_(part_keys[start:start + chunk_size])))
+            existing.update(tuple(row) for row in conn.execute(query))
+
+        now = datetime.datetime.now()
+        new, seen = [], []
+        for (key, vehicle_id, assembly_id), job_id in postings.items():
+            values = {'key': key, 'vehicle': vehicle_id, 'assembly': assembly_id, 'job_id': job_id, 'now': now}
+            (seen if (key, vehicle_id, assembly_id) in existing else new).append(values)
+        if seen:
+            conn.execute(usage.update().where(and_(usage.c.table_name == self.table.name,
+                                                   usage.c.part_key == bindparam('key'),
+                                                   usage.c.vehicle_id == bindparam('vehicle'),
+                                                   usage.c.assembly_id == bindparam('assembly'))).
+                         values(last_job=bindparam('job_id'), last_seen=bindparam('now')), seen)
+        if new:
+            conn.execute(usage.insert(), [{'part_key': p['key'], 'table_name': self.table.name,
+                                           'vehicle_id': p['vehicle'], 'assembly_id': p['assembly'],
+                                           'first_job': p['job_id'], 'last_job': p['job_id'],
+                                           'last_seen': now} for p in new])
+        self.inc_stats('where_used/new', len(new))
+        self.inc_stats('where_used/seen', len(seen))
+
+        # remembered once written, a rolled back batch is recorded again when the writer retries its rows
+        with self.lock:
+            self.written.update((posting, True) for posting in postings)
+            while len(self.written) > self.max_size:
+                self.written.popitem(last=False)
+
+    def inc_stats(self, key, count):
+        if self.stats and count:
+            self.stats.inc_value(key, count, spider=self.spider)
+
+
+def postings(conn, part_number, table_name=None):
+    """(table_name, vehicle_id, assembly_id, first_job, last_job) postings of a part, from its primary key index"""
+    usage = PartUsage.__table__
+    query = select([usage.c.table_name, usage.c.vehicle_id, usage.c.assembly_id, usage.c.first_job,
+                    usage.c.last_job]).where(usage.c.part_key == part_key(part_number))
+    if table_name:
+        query = query.where(usage.c.table_name == table_name)
+    return conn.execute(query.order_by(usage.c.table_name, usage.c.vehicle_id, usage.c.assembly_id)).fetchall()
+
+
+def where_used(conn, part_number, table_name=None, chunk_size=500):
+    """
+    Vehicles and assembly sets using a part, as dicts of the posting with the vehicle and AssemblySet columns:
+    the postings and then the dimension rows of each part table with one query per chunk of ids.
+    """
+    found = postings(conn, part_number, table_name)
+    vehicles, assembly_sets = {}, lookup(conn, AssemblySet, {p.assembly_id for p in found}, chunk_size)
+    for name in {p.table_name for p in found}:
+        ids = {p.vehicle_id for p in found if p.table_name == name}
+        vehicles[name] = lookup(conn, PART_TABLES[name].vehicle_cls, ids, chunk_size)
+
+    used = []
+    for p in found:
+        row = dict(p)
+        row.update(vehicles[p.table_name].get(p.vehicle_id, {}))
+        row.update(assembly_sets.get(p.assembly_id, {}))
+        used.append(row)
+    return used
+
+
+def lookup(conn, dim_cls, ids, chunk_size=500):
+    """Values of dimension rows by id"""
+    dim_table, ids, rows = dim_cls.__table__, list(ids), {}
+    columns = [dim_table.c[c] for c in dimension_columns(dim_cls)]
+    for start in range(0, len(ids), chunk_size):
+        query = select([dim_table.c.id] + columns).where(dim_table.c.id.in_(ids[start:start + chunk_size]))
+        for row in conn.execute(query):
+            rows[row[0]] = {c.key: v for c, v in zip(columns, row[1:])}
+    return rows
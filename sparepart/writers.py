@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+# buffered database writers used by the item pipelines
+import time
+import logging
+import threading
+from collections import OrderedDict
+from twisted.internet import defer, reactor, threads
+from twisted.python.threadpool import ThreadPool
+from sqlalchemy import Sequence, select, and_
+from sqlalchemy.exc import IntegrityError
+from .bloom import BloomFilter
+
+logger = logging.getLogger(__name__)
+
+
+class BatchWriter(object):
+    """
+    Buffer rows per table and write them with one executemany per table and one commit per batch.
+
+    A batch is flushed when it holds `batch_size` rows, when the oldest row is older than
+    `batch_interval` seconds (see `flush_expired`) and when the spider is closed.
+    `recorders` get the rows of every batch in its transaction, see e.g. history.ChangeHistory.
+    """
+
+    def __init__(self, engine, batch_size=500, batch_interval=10, stats=None, spider=None, recorders=()):
+        self.engine = engine
+        self.recorders = list(recorders)
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.stats = stats
+        self.spider = spider
+        self.buffer = []
+        self.first_added = None
+        self.lock = threading.Lock()
+
+    def add(self, model_cls, row, children=None):
+        """
+        Buffer one row of `model_cls`, a model or a Table.
+
+        `children` is a list of (model_cls, row, fk) for rows referencing the parent row,
+        `fk` is the column receiving the parent id, e.g. (ImageLinkIsuzu, {'image_id': 1}, 'part_id').
+        """
+        table = getattr(model_cls, '__table__', model_cls)
+        if table is not model_cls:
+            row = column_row(model_cls, row)
+        children = [(cls.__table__, column_row(cls, r), fk) for cls, r, fk in children or []]
+        with self.lock:
+            self.buffer.append((table, row, children))
+            if self.first_added is None:
+                self.first_added = time.time()
+            full = len(self.buffer) >= self.batch_size
+        if full:
+            self.flush()
+
+    def flush_expired(self):
+        if self.first_added is not None and time.time() - self.first_added >= self.batch_interval:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            units, self.buffer, self.first_added = self.buffer, [], None
+        if not units:
+            return
+
+        try:
+            with self.engine.begin() as conn:
+                self.write(conn, units)
+            self.inc_stats('db_writer/rows', len(units))
+            self.inc_stats('db_writer/batches')
+        except IntegrityError as e:
+            # isolate the offending rows: retry every row in its own transaction
+            logger.warning('IntegrityError in batch of {} rows, retrying row by row. {}'.format(len(units), str(e)))
+            for unit in units:
+                try:
+                    with self.engine.begin() as conn:
+                        self.write(conn, [unit])
+                    self.inc_stats('db_writer/rows')
+                except IntegrityError as e:
+                    logger.warning("IntegrityError Exception. {} - {}".format(type(e), str(e)))
+                    self.inc_stats('db_writer/integrity_error')
+        except Exception as e:
+            logger.error("EXCEPTION... {} - {}".format(type(e), str(e)))
+            self.inc_stats('db_writer/failed_rows', len(units))
+
+    def write(self, conn, units):
+        self.record(conn, units)
+        self.insert(conn, units)
+
+    def record(self, conn, units):
+        """Run the recorders, each in a savepoint: a failing recorder is logged and never costs the rows"""
+        for recorder in self.recorders:
+            savepoint = conn.begin_nested()
+            try:
+                recorder.record(conn, units)
+                savepoint.commit()
+            except Exception as e:
+                savepoint.rollback()
+                logger.error("{} failed. {} - {}".format(recorder.__class__.__name__, type(e), str(e)))
+                self.inc_stats('db_writer/recorder_errors')
+
+    def insert(self, conn, units):
+        parents, children = {}, {}
+        for table, row, child_rows in units:
+            row = {k: v for k, v in row.items() if k in table.c}
+            if child_rows and 'id' not in row:
+                # child rows need the parent id before the insert
+                row['id'] = next_id(conn, table)
+                if row['id'] is None:
+                    # no sequence (e.g. sqlite): insert the parent alone to get its generated id
+                    del row['id']
+                    row['id'] = conn.execute(table.insert(), row).inserted_primary_key[0]
+                else:
+                    parents.setdefault((table, tuple(sorted(row))), []).append(row)
+            else:
+                parents.setdefault((table, tuple(sorted(row))), []).append(row)
+            for child_table, child_row, fk in child_rows:
+                child_row = {k: v for k, v in child_row.items() if k in child_table.c}
+                child_row[fk] = row['id']
+                children.setdefault((child_table, tuple(sorted(child_row))), []).append(child_row)
+
+        # rows of the same table with the same columns go in one executemany (array binding on cx_Oracle)
+        for group in (parents, children):
+            for (table, _), rows in group.items():
+                conn.execute(table.insert(), rows)
+
+    def inc_stats(self, key, count=1):
+        if self.stats:
+            self.stats.inc_value(key, count, spider=self.spider)
+
+
+class MergeWriter(BatchWriter):
+    """
+    BatchWriter upserting the rows of the tables passed to `load_keys` on their `row_key` (see models.RowHashMixin):
+    a row whose key is in the table is updated when its `content_hash` changed and skipped otherwise,
+    other rows are inserted. Within a batch the last row of a key wins.
+
+    The keys in the table are kept in a Bloom filter, see `load_keys`. Rows whose key is not in it are
+    new and inserted without a lookup, the others are looked up with one query per table and batch.
+    """
+
+    def __init__(self, engine, bloom_capacity=1000000, bloom_error_rate=0.01, **kwargs):
+        super(MergeWriter, self).__init__(engine, **kwargs)
+        self.known = BloomFilter(bloom_capacity, bloom_error_rate)
+        self.tables = set()
+
+    def load_keys(self, table):
+        """Merge the rows of `table` from now on, loading its keys in the Bloom filter"""
+        self.tables.add(table)
+        with self.engine.connect() as conn:
+            query = select([table.c.row_key]).where(table.c.row_key.isnot(None))
+            for row_key, in conn.execution_options(stream_results=True).execute(query):
+                self.known.add(row_key)
+
+    def write(self, conn, units):
+        self.record(conn, units)
+
+        merged, other = OrderedDict(), []
+        for unit in units:
+            table, row, _ = unit
+            if table in self.tables and row.get('row_key'):
+                merged[(table, row['row_key'])] = unit
+            else:
+                other.append(unit)
+
+        existing = self.lookup(conn, [key for key in merged if key[1] in self.known])
+        for key, unit in merged.items():
+            if key not in existing:
+                other.append(unit)
+                continue
+            table, row, children = unit
+            part_id, job_id, content_hash = existing[key]
+            if content_hash == row.get('content_hash'):
+                self.inc_stats('db_writer/unchanged')
+                continue
+            values = {k: v for k, v in row.items() if k in table.c and k != 'id'}
+            conn.execute(table.update().where(and_(table.c.id == part_id, table.c.job_id == job_id)), values)
+            for child_table, child_row, fk in children:
+                conn.execute(child_table.delete().where(child_table.c[fk] == part_id))
+            for child_table, child_row, fk in children:
+                child_row = {k: v for k, v in child_row.items() if k in child_table.c}
+                child_row[fk] = part_id
+                conn.execute(child_table.insert(), child_row)
+            self.inc_stats('db_writer/updated')
+
+        self.insert(conn, other)
+        for table, row_key in merged:
+            self.known.add(row_key)
+
+    def lookup(self, conn, keys, chunk_size=500):
+        """(id, job_id, content_hash) of the rows with the given (table, row_key), by (table, row_key)"""
+        by_table = {}
+        for table, row_key in keys:
+            by_table.setdefault(table, []).append(row_key)
+        existing = {}
+        for table, row_keys in by_table.items():
+            for start in range(0, len(row_keys), chunk_size):
+                query = select([table.c.row_key, table.c.id, table.c.job_id, table.c.content_hash]).\
+                    where(table.c.row_key.in_(row_keys[start:start + chunk_size]))
+                for row_key, part_id, job_id, content_hash in conn.execute(query):
+                    existing[(table, row_key)] = (part_id, job_id, content_hash)
+        self.inc_stats('db_writer/lookups', len(keys))
+        return existing
+
+
+class WriterPool(object):
+    """
+    Run blocking database writes on a dedicated thread pool and return Deferreds to Scrapy.
+
+    At most `max_pending` writes are queued or running. Further items wait for a free slot,
+    which keeps their responses active in the scraper so the engine stops feeding the downloader
+    while the database is behind.
+    """
+
+    def __init__(self, threads=1, max_pending=100, stats=None, spider=None, name='db_writer'):
+        self.threadpool = ThreadPool(minthreads=threads, maxthreads=threads, name=name)
+        self.semaphore = defer.DeferredSemaphore(max_pending)
+        self.stats = stats
+        self.spider = spider
+        self.pending = set()
+
+    def start(self):
+        self.threadpool.start()
+
+    def run(self, func, *args, **kwargs):
+        d = self.semaphore.run(self.call, func, *args, **kwargs)
+        self.pending.add(d)
+        self.set_depth()
+
+        def done(result):
+            self.pending.discard(d)
+            self.set_depth()
+            return result
+
+        return d.addBoth(done)
+
+    def call(self, func, *args, **kwargs):
+        def timed():
+            start = time.time()
+            result = func(*args, **kwargs)
+            return result, time.time() - start
+
+        return threads.deferToThreadPool(reactor, self.threadpool, timed).addCallback(self.record_latency)
+
+    def record_latency(self, result):
+        result, elapsed = result
+        if self.stats:
+            self.stats.inc_value('db_writer/writes', spider=self.spider)
+            self.stats.inc_value('db_writer/write_time', elapsed, spider=self.spider)
+            self.stats.max_value('db_writer/max_write_time', elapsed, spider=self.spider)
+        return result
+
+    def set_depth(self):
+        if self.stats:
+            self.stats.set_value('db_writer/queue_depth', len(self.pending), spider=self.spider)
+            self.stats.max_value('db_writer/max_queue_depth', len(self.pending), spider=self.spider)
+
+    def close(self):
+        """Wait for the queued writes, then stop the threads"""
+        d = defer.DeferredList(list(self.pending))
+        d.addBoth(lambda _: self.threadpool.stop())
+        return d
+
+
+def next_id(conn, table):
+    """Fetch the next primary key from the id sequence of the table, None when the database has no sequences"""
+    default = table.c.id.default
+    if isinstance(default, Sequence) and conn.dialect.supports_sequences:
+        return conn.execute(default)
+
+
+_unknown_keys = set()
+
+
+def column_row(model_cls, row):
+    """
+    Translate the attribute names of a model to its column names, e.g. SparepartIsuzu.key -> key_.
+    Keys that are neither are not written, they are logged once per model.
+    """
+    columns = {prop.key: prop.columns[0].key for prop in model_cls.__mapper__.column_attrs}
+    table = model_cls.__table__
+    for k in row:
+        if k not in columns and k not in table.c and (table.name, k) not in _unknown_keys:
+            _unknown_keys.add((table.name, k))
+            logger.warning('{} has no column {}, its values are not written'.format(table.name, k))
+    return {columns.get(k, k): v for k, v in row.items()}
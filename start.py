@@ -8,12 +8,11 @@ import jinja2
 import shutil
 from configparser import ConfigParser
 from time import sleep
-from sqlalchemy import create_engine
 from sqlalchemy.orm import scoped_session
 from sqlalchemy.orm import sessionmaker
 
 from scrapy.utils.project import get_project_settings
-from sparepart.models import ScrapingJob
+from sparepart.models import ScrapingJob, db_connect
 from crawler_queue import CrawlerQueue
 
 
@@ -36,7 +35,7 @@ SCRAPYD_HOST = 'http://{}:{}'.format('localhost',
 # create database session
 CONNECTION_STRING = os.environ.get('CONNECTION_STRING')
 if CONNECTION_STRING:
-    engine = create_engine(CONNECTION_STRING, echo=True)
+    engine = db_connect(CONNECTION_STRING)
     session_factory = sessionmaker(bind=engine)
     Session = scoped_session(session_factory)
 
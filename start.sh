@@ -3,6 +3,7 @@ echo 'setting up environment variables'
 sleep 1
 unset NO_CREATE_TABLES
 unset SAVE_AS_JSON
+unset SAVE_AS_PARQUET
 unset CONNECTION_STRING
 set -a
 source config.ini
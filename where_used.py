@@ -0,0 +1,24 @@
+# list the vehicles and assembly sets using a part number, in all part tables or in one of them
+# usage: python where_used.py <part number> [part table]
+#   e.g. python where_used.py 8-97123456-0 scraping_sparepart_isuzu
+import sys
+from sparepart.models import db_connect
+from sparepart.whereused import where_used, PART_TABLES
+
+if len(sys.argv) not in (2, 3):
+    print('usage: python where_used.py <part number> [part table]')
+    sys.exit(1)
+
+table = sys.argv[2] if len(sys.argv) == 3 else None
+if table and table not in PART_TABLES:
+    print('unknown part table {}'.format(table))
+    sys.exit(1)
+
+with db_connect().connect() as conn:
+    used = where_used(conn, sys.argv[1], table)
+    for row in used:
+        # vehicle columns differ per part table
+        details = ', '.join('{}={}'.format(k, v) for k, v in sorted(row.items()) if v and k not in
+                            ('table_name', 'vehicle_id', 'assembly_id', 'first_job', 'last_job'))
+        print('{}\t{}\t{}'.format(row['table_name'], details, row['last_job']))
+    print('{} postings'.format(len(used)))